@@ -1,14 +1,16 @@
 import logging
 import logging.config
 import os
+import io
+import json
+import hashlib
 from tempfile import TemporaryDirectory
 import pandas as pd
-import asyncio
 
 import azure.functions as func
 from wilkins.tools.azure import AzureStorage
 from wilkins.project import Project
-from wilkins.utils.database import fetch_submissions
+from wilkins.utils.database import fetch_submissions, run_async
 from wilkins.utils.auth import get_access_token
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
@@ -17,6 +19,8 @@ INPUT_CONTAINER = "attachments"
 IMAGES_CONTAINER = "images"
 OUTPUT_CONTAINER = "results"
 LOCAL_WORKDIR = "./output"
+# Output blob metadata key holding the digest of the submissions it was generated from
+SUBMISSIONS_DIGEST_KEY = "submissions_digest"
 TEMPLATE_PATH = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "wilkins", "data", "template.pptx"
 )
@@ -24,6 +28,56 @@ TEMPLATE_PATH = os.path.join(
 # log_conf_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logging.conf")
 # logging.config.fileConfig(log_conf_file)
 
+# Shared by all invocations on this worker, so its HTTP connection pool stays warm
+_azure_storage = None
+
+
+def get_azure_storage():
+    global _azure_storage
+    if _azure_storage is None:
+        _azure_storage = AzureStorage(
+            connection_string=os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+        )
+    return _azure_storage
+
+
+def submissions_digest(submissions_data):
+    """Hashes the submissions an output file is generated from, to tell when it is stale"""
+    payload = json.dumps(submissions_data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def output_sas_url(azure_storage, project, file_name):
+    """Signs the URL of a known output file, without listing the project folder"""
+    return azure_storage.generate_blob_sas_url(
+        OUTPUT_CONTAINER, f"{project}/{file_name}"
+    )
+
+
+def cached_output_url(azure_storage, project, file_name, digest):
+    """
+    Returns the SAS URL of an existing output file if it is still up to date, otherwise None.
+    It is up to date if it was generated from the same submissions after the last attachment arrived.
+    """
+    properties = azure_storage.get_blob_properties(
+        OUTPUT_CONTAINER, f"{project}/{file_name}"
+    )
+    if properties is None or properties.metadata.get(SUBMISSIONS_DIGEST_KEY) != digest:
+        return None
+
+    attachments_modified = azure_storage.folder_last_modified(
+        INPUT_CONTAINER, f"{project}/"
+    )
+    if (
+        attachments_modified is not None
+        and attachments_modified > properties.last_modified
+    ):
+        return None
+
+    logging.info(f"Reusing up to date {file_name} of project {project}")
+    return output_sas_url(azure_storage, project, file_name)
+
+
 @app.route(route="http_trigger")
 def http_trigger(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Python HTTP trigger function processed a request.")
@@ -44,46 +98,82 @@ def http_trigger(req: func.HttpRequest) -> func.HttpResponse:
             logging.error(f"Unable to get access-token for CLI: {e}")
             return func.HttpResponse(f"Unable to get access-token for CLI: {e}")
 
+        base_url = os.getenv("BASE_URL")
+        # access_token = os.getenv("ACCESS_TOKEN")
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+        }
+        azure_storage = get_azure_storage()
+        # Skip processing the project if its presentation is already up to date
+        response = run_async(fetch_submissions(base_url, headers, project))
+        if response is not None:
+            cached_url = cached_output_url(
+                azure_storage,
+                project,
+                "output.pptx",
+                submissions_digest(response["data"]),
+            )
+            if cached_url is not None:
+                return func.HttpResponse(cached_url)
+
         with TemporaryDirectory() as temp_dir:
             working_dir = os.path.join(temp_dir, "output")
             logging.info(f"Current Working Directory : {working_dir}")
             os.makedirs(working_dir, exist_ok=True)
-            p = Project.create_from_azure_container(INPUT_CONTAINER, project, access_token, working_dir)
-            presentation_path = os.path.join(working_dir, "output.pptx")
-            p.process_data(os.getenv("AZURE_STORAGE_CONNECTION_STRING"),container_name=IMAGES_CONTAINER)
-            base_url = os.getenv("BASE_URL")
-            # access_token = os.getenv("ACCESS_TOKEN")
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json",
-            }
-            response = asyncio.run(fetch_submissions(base_url, headers, project))
-            azure_storage = AzureStorage(
-                connection_string=os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+            p = Project.create_from_azure_container(
+                INPUT_CONTAINER,
+                project,
+                access_token,
+                working_dir,
+                azure_storage=azure_storage,
+            )
+            p.process_data(
+                os.getenv("AZURE_STORAGE_CONNECTION_STRING"),
+                container_name=IMAGES_CONTAINER,
             )
-            p.create_ppt(pd.DataFrame(response['data']),presentation_path,azure_storage=azure_storage,container_name=IMAGES_CONTAINER, template_path=TEMPLATE_PATH)
-            azure_storage.upload_file_to_folder(
-                OUTPUT_CONTAINER, project, presentation_path
+            response = run_async(fetch_submissions(base_url, headers, project))
+            metadata = {SUBMISSIONS_DIGEST_KEY: submissions_digest(response["data"])}
+            # Generate the output in memory and upload it straight from there
+            presentation = io.BytesIO()
+            p.create_ppt(
+                pd.DataFrame(response["data"]),
+                presentation,
+                azure_storage=azure_storage,
+                container_name=IMAGES_CONTAINER,
+                template_path=TEMPLATE_PATH,
             )
-            result = azure_storage.generate_powerpoint_sas_urls(
-                OUTPUT_CONTAINER, project
+            azure_storage.upload_stream_to_folder(
+                OUTPUT_CONTAINER,
+                project,
+                presentation,
+                "output.pptx",
+                metadata=metadata,
             )
+            result = output_sas_url(azure_storage, project, "output.pptx")
 
             # TODO error handling
-        return func.HttpResponse(f"{list(result.values())[0]}")
+        return func.HttpResponse(result)
 
     else:
         return func.HttpResponse(
             "This HTTP triggered function executed successfully. Pass a project in the query string or in the request body for a personalized response.",
             status_code=200,
         )
-    
-@app.blob_trigger(path=INPUT_CONTAINER + "/{project}/{name}", connection="AzureWebJobsStorage", arg_name="blob")
+
+
+@app.blob_trigger(
+    path=INPUT_CONTAINER + "/{project}/{name}",
+    connection="AzureWebJobsStorage",
+    arg_name="blob",
+)
 def blob_trigger(blob: func.InputStream):
-    logging.info(f"Blob trigger function processed blob\n"
-                 f"Name: {blob.name}\n"
-                 f"Blob Size: {blob.length} bytes")
-    project_name = blob.name.split('/')[1]
+    logging.info(
+        f"Blob trigger function processed blob\n"
+        f"Name: {blob.name}\n"
+        f"Blob Size: {blob.length} bytes"
+    )
+    project_name = blob.name.split("/")[1]
 
     try:
         access_token = get_access_token()
@@ -92,14 +182,24 @@ def blob_trigger(blob: func.InputStream):
         return
 
     with TemporaryDirectory() as temp_dir:
-            working_dir = os.path.join(temp_dir, "output")
-            logging.info(f"Current Working Directory : {working_dir}")
-            os.makedirs(working_dir, exist_ok=True)
-            p = Project.create_from_azure_container(INPUT_CONTAINER, project_name, access_token, working_dir)
-            p.process_data(os.getenv("AZURE_STORAGE_CONNECTION_STRING"),container_name=IMAGES_CONTAINER)
+        working_dir = os.path.join(temp_dir, "output")
+        logging.info(f"Current Working Directory : {working_dir}")
+        os.makedirs(working_dir, exist_ok=True)
+        p = Project.create_from_azure_container(
+            INPUT_CONTAINER,
+            project_name,
+            access_token,
+            working_dir,
+            azure_storage=get_azure_storage(),
+        )
+        p.process_data(
+            os.getenv("AZURE_STORAGE_CONNECTION_STRING"),
+            container_name=IMAGES_CONTAINER,
+        )
+
 
 def generate_file_sas_url(file_type, project):
-    azure_storage = AzureStorage(connection_string=os.getenv("AZURE_STORAGE_CONNECTION_STRING"))
+    azure_storage = get_azure_storage()
 
     if file_type.lower() == "ppt":
         result = azure_storage.generate_powerpoint_sas_urls(OUTPUT_CONTAINER, project)
@@ -112,6 +212,7 @@ def generate_file_sas_url(file_type, project):
 
     return result
 
+
 @app.route(route="generate_sas_url")
 def generate_sas_url(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Generate SAS URL function processed a request.")
@@ -122,7 +223,7 @@ def generate_sas_url(req: func.HttpRequest) -> func.HttpResponse:
     if not project or not file_type:
         return func.HttpResponse(
             "Please specify both 'project' and 'file_type' ('ppt', 'excel', or 'zip') in the query string.",
-            status_code=400
+            status_code=400,
         )
 
     try:
@@ -131,46 +232,96 @@ def generate_sas_url(req: func.HttpRequest) -> func.HttpResponse:
         logging.error(f"Unable to get access-token for CLI: {e}")
         return func.HttpResponse(f"Unable to get access-token for CLI: {e}")
 
+    base_url = os.getenv("BASE_URL")
+    # access_token = os.getenv("ACCESS_TOKEN")
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json",
+    }
+    response = run_async(fetch_submissions(base_url, headers, project, selected=True))
+    azure_storage = get_azure_storage()
+    metadata = {SUBMISSIONS_DIGEST_KEY: submissions_digest(response["data"])}
+
+    # Skip generating the file if it is already up to date
+    output_files = {
+        "ppt": "output.pptx",
+        "excel": "output.xlsx",
+        "zip": "combined_files.zip",
+    }
+    if file_type.lower() in output_files:
+        cached_url = cached_output_url(
+            azure_storage,
+            project,
+            output_files[file_type.lower()],
+            metadata[SUBMISSIONS_DIGEST_KEY],
+        )
+        if cached_url is not None:
+            return func.HttpResponse(cached_url)
+
     with TemporaryDirectory() as temp_dir:
-            working_dir = os.path.join(temp_dir, "output")
-            logging.info(f"Current Working Directory : {working_dir}")
-            os.makedirs(working_dir, exist_ok=True)
-            p = Project.create_from_azure_container(INPUT_CONTAINER, project, access_token, working_dir)
-            presentation_path = os.path.join(working_dir, "output.pptx")
-            excel_path = os.path.join(working_dir, "output.xlsx")
-            zip_path = os.path.join(working_dir, "combined_files.zip")
-            base_url = os.getenv("BASE_URL")
-            # access_token = os.getenv("ACCESS_TOKEN")
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json",
-            }
-            response = asyncio.run(fetch_submissions(base_url, headers, project, selected=True))
-            azure_storage = AzureStorage(
-                connection_string=os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+        working_dir = os.path.join(temp_dir, "output")
+        logging.info(f"Current Working Directory : {working_dir}")
+        os.makedirs(working_dir, exist_ok=True)
+        p = Project.create_from_azure_container(
+            INPUT_CONTAINER,
+            project,
+            access_token,
+            working_dir,
+            download_attachments=False,
+            azure_storage=azure_storage,
+        )
+        # Generate the outputs in memory and upload them straight from there
+        presentation = io.BytesIO()
+        excel = io.BytesIO()
+        combined_files = io.BytesIO()
+        submissions_df = pd.DataFrame(response["data"])
+        if file_type.lower() == "ppt":
+            p.create_ppt(
+                submissions_df,
+                presentation,
+                azure_storage=azure_storage,
+                container_name=IMAGES_CONTAINER,
+                template_path=TEMPLATE_PATH,
+            )
+            azure_storage.upload_stream_to_folder(
+                OUTPUT_CONTAINER,
+                project,
+                presentation,
+                "output.pptx",
+                metadata=metadata,
+            )
+            return func.HttpResponse(
+                output_sas_url(azure_storage, project, "output.pptx")
+            )
+        elif file_type.lower() == "excel":
+            p.create_excel(submissions_df, excel)
+            azure_storage.upload_stream_to_folder(
+                OUTPUT_CONTAINER, project, excel, "output.xlsx", metadata=metadata
+            )
+            return func.HttpResponse(
+                output_sas_url(azure_storage, project, "output.xlsx")
             )
-            if file_type.lower() == "ppt":
-                p.create_ppt(pd.DataFrame(response['data']),presentation_path,azure_storage=azure_storage,container_name=IMAGES_CONTAINER, template_path=TEMPLATE_PATH)
-                azure_storage.upload_file_to_folder(
-                    OUTPUT_CONTAINER, project, presentation_path
-                )
-                result = azure_storage.generate_powerpoint_sas_urls(OUTPUT_CONTAINER, project)
-                return func.HttpResponse(f"{list(result.values())[0]}")
-            elif file_type.lower() == "excel":
-                p.create_excel(pd.DataFrame(response['data']),excel_path)
-                azure_storage.upload_file_to_folder(
-                    OUTPUT_CONTAINER, project, excel_path
-                )
-                result = azure_storage.generate_excel_sas_urls(OUTPUT_CONTAINER, project)
-                return func.HttpResponse(f"{list(result.values())[0]}")
-            elif file_type.lower() == "zip":
-                p.create_ppt(pd.DataFrame(response['data']),presentation_path,azure_storage=azure_storage,container_name=IMAGES_CONTAINER, template_path=TEMPLATE_PATH)
-                p.create_excel(pd.DataFrame(response['data']),excel_path)
-                p.zip_files(presentation_path,excel_path, zip_path)
-                azure_storage.upload_file_to_folder(
-                    OUTPUT_CONTAINER, project, zip_path
-                )
-                result = azure_storage.generate_zip_sas_urls(OUTPUT_CONTAINER, project)
-                return func.HttpResponse(f"{list(result.values())[0]}")
-            else:
-                raise ValueError("Invalid file type. Expected 'ppt', 'excel', or 'zip'.")
\ No newline at end of file
+        elif file_type.lower() == "zip":
+            p.create_ppt(
+                submissions_df,
+                presentation,
+                azure_storage=azure_storage,
+                container_name=IMAGES_CONTAINER,
+                template_path=TEMPLATE_PATH,
+            )
+            p.create_excel(submissions_df, excel)
+            p.zip_streams(
+                {"output.pptx": presentation, "output.xlsx": excel}, combined_files
+            )
+            azure_storage.upload_stream_to_folder(
+                OUTPUT_CONTAINER,
+                project,
+                combined_files,
+                "combined_files.zip",
+                metadata=metadata,
+            )
+            return func.HttpResponse(
+                output_sas_url(azure_storage, project, "combined_files.zip")
+            )
+        else:
+            raise ValueError("Invalid file type. Expected 'ppt', 'excel', or 'zip'.")
@@ -3,49 +3,47 @@ import numpy as np
 from typing import List
 import re
 import logging
+import ahocorasick
 
 logger = logging.getLogger(__name__)
 
+_BRACKETS_RE = re.compile(r"\(.*?\)")
+_SPLIT_RE = re.compile(r"[&@]")
 
-def check_all_values_same_for_each_category(
-    dataframe, category_column, target_column, target_value
-):
-    if (
-        category_column not in dataframe.columns
-        or target_column not in dataframe.columns
-    ):
-        raise ValueError("Specified column not found in DataFrame.")
 
-    results = {}
-    for category in dataframe[category_column].unique():
-        filtered_df = dataframe[dataframe[category_column] == category]
-        all_match = (filtered_df[target_column] == target_value).all()
-        results[category] = all_match
+def _find_keys_in_pages(keys, pages):
+    """Flags which keys occur in which page, scanning each page once with Aho-Corasick"""
+    found = np.zeros((len(keys), len(pages)), dtype=bool)
+    empty_keys = [key_idx for key_idx, key in enumerate(keys) if not key]
 
-        if not all_match:
-            mismatching_values = filtered_df[
-                filtered_df[target_column] != target_value
-            ][target_column]
-            logger.info(f"Mismatching values in category '{category}':")
-            logger.info(mismatching_values.to_string(index=False))
+    automaton = ahocorasick.Automaton()
+    for key_idx, key in enumerate(keys):
+        if key:
+            automaton.add_word(key, key_idx)
+    automaton.make_automaton()
 
-    return results
+    for page_idx, page in enumerate(pages):
+        if isinstance(page, str):
+            # An empty key is contained in every page
+            found[empty_keys, page_idx] = True
+            if len(automaton):
+                found[[key_idx for _, key_idx in automaton.iter(page)], page_idx] = True
+        else:
+            # Epitch pages are lists of table cells, which only match whole cells
+            cells = {str(cell) for cell in page}
+            found[:, page_idx] = [key in cells for key in keys]
+    return found
 
 
-def _find_max_matching_pdf(row, page_content):
+def _key_values(submission: pd.DataFrame):
     key_cols = ["Unit #", "Latitude", "Longitude", "Size"]
+    key_df = submission[key_cols].astype(str)
 
-    # Function to remove text within brackets
-    def remove_brackets(text):
-        return re.sub(r"\(.*?\)", "", text).strip()
-
-    # Apply the function to the "Unit #" value if it exists in the row
-    if "Unit #" in row:
-        row["Unit #"] = remove_brackets(str(row["Unit #"]))
-
-    values = [row[col] for col in key_cols]
-    return_value = sum([1 for value in values if str(value) in page_content])
-    return return_value
+    # Remove text within brackets from the "Unit #" values
+    key_df["Unit #"] = (
+        key_df["Unit #"].str.replace(_BRACKETS_RE, "", regex=True).str.strip()
+    )
+    return key_df.to_numpy(dtype=str)
 
 
 def match_with_pdf_content(submission: pd.DataFrame, pdf_content, unit_number=None):
@@ -60,113 +58,141 @@ def match_with_pdf_content(submission: pd.DataFrame, pdf_content, unit_number=No
                 matching_rows.index, "match_image_index"
             ] = matching_rows.index
 
-    # pages_already_matched = set()
-
-    for row_idx, row in submission.iterrows():
-        if row.image_matched:
-            continue
+    unmatched = ~submission["image_matched"].astype(bool).to_numpy()
+    if len(pdf_content) == 0 or not unmatched.any():
+        return
 
-        scores = np.zeros((len(pdf_content)))
-        for idx, content in enumerate(pdf_content):
-            # if idx in pages_already_matched:
-            #     continue
-            scores[idx] = _find_max_matching_pdf(row, content)
+    # Score every unmatched row against every page at once: scores[row, page]
+    key_values = _key_values(submission[unmatched])
+    keys, key_index = np.unique(key_values, return_inverse=True)
+    found = _find_keys_in_pages(keys.tolist(), pdf_content)
+    scores = found[key_index.reshape(key_values.shape)].sum(axis=1)
 
-        logger.info("Matching score: %s", scores)
-        # Check if scores array is empty or all zeros
-        if np.any(scores):  # This will be False if scores is all zeros
-            matched_idx = np.argmax(scores)
-            # Only a non-zero match scores qualify as a match
-            if scores[matched_idx] > 0:
-                # pages_already_matched.add(matched_idx)
-                submission.at[row_idx, "image_matched"] = True
-                submission.at[row_idx, "match_image_index"] = matched_idx
+    logger.info("Matching scores: %s", scores)
+    # Only a non-zero match scores qualify as a match
+    has_match = scores.max(axis=1) > 0
+    matched_rows = submission.index[unmatched][has_match]
+    submission.loc[matched_rows, "image_matched"] = True
+    submission.loc[matched_rows, "match_image_index"] = scores.argmax(axis=1)[has_match]
 
 
 def match_with_image_files(submission: pd.DataFrame, filenames):
     """As filenames correspond to the Unit #, we are directly matching the filenames and sending the indexes for images"""
-    filenames_already_matched = set()
-    for row_idx, row in submission.iterrows():
-        unit_number = str(row["Unit #"]).strip().lower()
-        media_type = str(row["Media Type"]).strip().lower()
-        for idx, filename in enumerate(filenames):
-            # if filename in filenames_already_matched:
-            #     continue
-            cleaned_filename = filename.strip().lower()
-            if unit_number in cleaned_filename or media_type in cleaned_filename:
-                filenames_already_matched.add(filename)
-                submission.at[row_idx, "image_matched"] = True
-                submission.at[row_idx, "match_image_file_index"] = idx
-                break
-
-
-def match_mediatype_with_pdf_content(submission: pd.DataFrame, pdf_content):
-    for row_idx, row in submission.iterrows():
-        # Normalize the mediatype for comparison
-        mediatype_normalized = row["Media Type"].lower()
-        if "bus" in row["Media Type"].lower():
-            break
-        for idx, content in enumerate(pdf_content):
-            content_normalized = content.lower()
-
-            # Check various normalized versions of the mediatype against the content
-            if (
-                mediatype_normalized in content_normalized
-                or mediatype_normalized.rstrip("s") in content_normalized
-                or mediatype_normalized.rstrip("es") in content_normalized
-            ):
-                submission.at[row_idx, "image_matched"] = True
-                submission.at[row_idx, "match_image_index"] = idx
-                break
-            else:
-                # If no match, check for '&' and '@', and split
-                if "&" in mediatype_normalized or "@" in mediatype_normalized:
-                    parts = re.split(r"[&@]", mediatype_normalized)
-                    for part in parts:
-                        part = part.strip()
-                        if (
-                            part in content_normalized
-                            or part.rstrip("s") in content_normalized
-                            or part.rstrip("es") in content_normalized
-                        ):
-                            submission.at[row_idx, "image_matched"] = True
-                            submission.at[row_idx, "match_image_index"] = idx
-                            break
-                    if submission.at[row_idx, "image_matched"]:
-                        break
+    if len(filenames) == 0:
+        return
+
+    unit_numbers = submission["Unit #"].astype(str).str.strip().str.lower().to_numpy()
+    media_types = (
+        submission["Media Type"].astype(str).str.strip().str.lower().to_numpy()
+    )
+    cleaned_filenames = np.array([filename.strip().lower() for filename in filenames])
+
+    # matches[row, file] is True if the unit number or media type is in the filename
+    matches = (np.char.find(cleaned_filenames, unit_numbers[:, None]) >= 0) | (
+        np.char.find(cleaned_filenames, media_types[:, None]) >= 0
+    )
+    has_match = matches.any(axis=1)
+    matched_rows = submission.index[has_match]
+    submission.loc[matched_rows, "image_matched"] = True
+    submission.loc[matched_rows, "match_image_file_index"] = matches.argmax(axis=1)[
+        has_match
+    ]
+
+
+def _mediatype_variants(mediatype_normalized):
+    """Returns the normalized versions of a media type to look for in the content"""
+    variants = {
+        mediatype_normalized,
+        mediatype_normalized.rstrip("s"),
+        mediatype_normalized.rstrip("es"),
+    }
+    # Check the parts as well when the media type is split by '&' or '@'
+    if "&" in mediatype_normalized or "@" in mediatype_normalized:
+        for part in _SPLIT_RE.split(mediatype_normalized):
+            part = part.strip()
+            variants.update({part, part.rstrip("s"), part.rstrip("es")})
+    return variants
+
+
+def match_mediatype_with_pdf_content(
+    submission: pd.DataFrame, pdf_content, row_indices=None
+):
+    """Matches the rows with the given index labels (all rows by default) in place"""
+    if len(pdf_content) == 0:
+        return
+    if row_indices is None:
+        row_indices = submission.index
+
+    # Normalize the mediatypes for comparison
+    mediatypes_normalized = (
+        submission.loc[row_indices, "Media Type"].astype(str).str.lower()
+    )
+
+    # Matching stops at the first bus media type
+    is_bus = mediatypes_normalized.str.contains("bus", regex=False).to_numpy()
+    rows_to_match = is_bus.argmax() if is_bus.any() else len(is_bus)
+    if rows_to_match == 0:
+        return
+
+    row_variants = [
+        _mediatype_variants(mediatype)
+        for mediatype in mediatypes_normalized.iloc[:rows_to_match]
+    ]
+    variants = sorted(set().union(*row_variants))
+    variant_index = {variant: idx for idx, variant in enumerate(variants)}
+
+    # row_has_variant[row, variant] and variant_in_page[variant, page]
+    row_has_variant = np.zeros((rows_to_match, len(variants)), dtype=np.int64)
+    for row_idx, row_variant in enumerate(row_variants):
+        row_has_variant[row_idx, [variant_index[v] for v in row_variant]] = 1
+
+    contents_normalized = [
+        content.lower()
+        if isinstance(content, str)
+        else "\n".join(map(str, content)).lower()
+        for content in pdf_content
+    ]
+    variant_in_page = _find_keys_in_pages(variants, contents_normalized).astype(
+        np.int64
+    )
+
+    # A row matches the first page containing any of its variants
+    matches = (row_has_variant @ variant_in_page) > 0
+    has_match = matches.any(axis=1)
+    matched_rows = row_indices[:rows_to_match][has_match]
+    submission.loc[matched_rows, "image_matched"] = True
+    submission.loc[matched_rows, "match_image_index"] = matches.argmax(axis=1)[
+        has_match
+    ]
+
+
+def _vendors_all_false(dataframe, target_column):
+    """Flags, per vendor, whether all values of the target column are False"""
+    return ~dataframe.groupby("Vendor", sort=False, observed=True)[target_column].any()
 
 
 def match_media_type(submission: pd.DataFrame, pdf_content):
     # Check vendors
-    image_matched_value = False
-    vendors_to_check = check_all_values_same_for_each_category(
-        submission, "Vendor", "image_matched", image_matched_value
-    )
-    logger.info("Vendors To Check for media type matching : ", vendors_to_check)
-    # Process each vendor
-    for vendor, all_false in vendors_to_check.items():
-        if all_false:
-            vendor_df = submission[submission["Vendor"] == vendor]
-            match_mediatype_with_pdf_content(vendor_df, pdf_content)
-            # Update the original DataFrame
-            submission.update(vendor_df)
+    vendors_to_check = _vendors_all_false(submission, "image_matched")
+    vendors_to_check = vendors_to_check[vendors_to_check].index
+    logger.info("Vendors To Check for media type matching : %s", list(vendors_to_check))
+    # Process each vendor, matching its rows directly in the original DataFrame
+    vendor_rows = submission.groupby("Vendor", sort=False, observed=True).groups
+    for vendor in vendors_to_check:
+        match_mediatype_with_pdf_content(
+            submission, pdf_content, row_indices=vendor_rows[vendor]
+        )
 
 
 def match_bus_media(submission: pd.DataFrame):
-    image_matched_value = False
-    vendors_to_check = check_all_values_same_for_each_category(
-        submission, "Vendor", "image_matched", image_matched_value
+    # Flag every row of vendors without any matched image that offer a bus media type
+    # (rows without a vendor are never flagged)
+    vendor = submission["Vendor"]
+    is_bus = submission["Media Type"].str.contains("bus", case=False, na=False)
+    has_bus = is_bus.groupby(vendor, sort=False, observed=True).transform("any")
+    matched = (
+        submission["image_matched"]
+        .groupby(vendor, sort=False, observed=True)
+        .transform("any")
     )
-    for vendor, all_false in vendors_to_check.items():
-        if all_false:
-            # Check if its a bus media type
-            vendor_df = submission[submission["Vendor"] == vendor]
-
-            contains_bus = (
-                vendor_df["Media Type"].str.contains("bus", case=False, na=False).any()
-            )
-
-            # If 'Bus' is found in any row, set all values in 'bus_media' column to 1
-            if contains_bus:
-                vendor_df["bus_media"] = 1
-                submission.update(vendor_df)
+    submission.loc[has_bus.eq(True) & matched.eq(False), "bus_media"] = 1
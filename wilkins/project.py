@@ -4,7 +4,6 @@ from wilkins.matching import (
     match_media_type,
     match_bus_media,
 )
-import asyncio
 from wilkins.utils.images import extract_images_and_filenames
 from wilkins.utils.dropbox import download_and_extract_zip
 from wilkins.utils.msg import fetch_files_and_extract_links, classify_all_links
@@ -21,48 +20,158 @@ from wilkins.utils.excel import (
     extract_images_to_dict,
     append_images_to_df,
 )
-from wilkins.tools.azure import AzureStorage
+from wilkins.tools.azure import AzureStorage, AsyncAzureStorage
+from azure.core.exceptions import AzureError
 from wilkins.utils.gdrive import download_file_from_google_drive
 from wilkins.utils.database import (
     check_and_create_project,
     check_and_create_vendor,
     create_submission,
+    run_async,
 )
 import os
 from typing import Optional, List
 import logging
 import glob
 import pandas as pd
+import numpy as np
 import random
 import requests
 from dotenv import load_dotenv
-import shutil
 import zipfile
-import tempfile
+import io
+import base64
+import datetime
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-
-async def load_image(image_index, media_images, image_data):
-    if image_index != -1:
-        return media_images[image_index]
-    else:
+# Container holding the parsed submissions of each version of a project's attachments
+CACHE_CONTAINER = "internal-cache"
+# Part of the cache key, bump it whenever the parsing of the attachments changes so
+# submissions parsed by older code are not reused
+CACHE_VERSION = 1
+
+
+async def _download_blobs(connection_string, container_name, blob_names, folder):
+    async with AsyncAzureStorage(connection_string) as azure_storage:
+        await azure_storage.download_files(container_name, blob_names, folder)
+
+
+def _process_one_xlsx(file) -> List[pd.DataFrame]:
+    logger.info(f"Processing {file} for vendor submissions")
+    target_sheets, header_rows = detect_sheet_and_header(file)
+
+    logger.debug(f"{file}\n has {len(target_sheets)} sheets.")
+
+    if not target_sheets:
+        logger.info(f"Warning: No suitable sheet found in {file}. Skipping.")
+        return []
+
+    # Extract all images from the .xlsx file
+    all_images = extract_images_to_dict(file)
+    # Call append_images_to_df to get a dictionary of DataFrames
+    data_dict = append_images_to_df(file, target_sheets, header_rows, all_images)
+
+    # Extract the DataFrames from the dictionary
+    return list(data_dict.values())
+
+
+def _blobs_fingerprint(blobs) -> str:
+    """Identifies a set of blobs by their names and etags, which change with their content"""
+    digest = hashlib.sha256()
+    for name, etag in sorted((blob.name, blob.etag) for blob in blobs):
+        digest.update(f"{name}\0{etag}\0".encode())
+    return digest.hexdigest()
+
+
+# Tag of each type of cell found in the object columns of the submissions. Parquet
+# only stores columns of a single type, so the cells of the object columns are
+# cached as tagged strings, which are decoded back to the same types
+_CACHE_CELL_TAGS = {
+    str: "s",
+    bool: "b",
+    int: "i",
+    float: "f",
+    np.bool_: "B",
+    np.int64: "I",
+    np.float64: "F",
+    pd.Timestamp: "t",
+    datetime.datetime: "T",
+    datetime.date: "d",
+    datetime.time: "h",
+    type(pd.NaT): "N",
+    bytes: "x",
+}
+_CACHE_CELL_DECODERS = {
+    "s": str,
+    "b": lambda text: text == "True",
+    "i": int,
+    "f": float,
+    "B": lambda text: np.bool_(text == "True"),
+    "I": np.int64,
+    "F": np.float64,
+    "t": pd.Timestamp,
+    "T": datetime.datetime.fromisoformat,
+    "d": datetime.date.fromisoformat,
+    "h": datetime.time.fromisoformat,
+    "N": lambda text: pd.NaT,
+    "x": base64.b64decode,
+}
+
+
+def _encode_cache_cell(value):
+    if value is None:
         return None
+    tag = _CACHE_CELL_TAGS.get(type(value))
+    if tag is None:
+        raise TypeError(f"Cells of type {type(value).__name__} cannot be cached")
+    if tag == "x":
+        text = base64.b64encode(value).decode()
+    elif tag in "fF":
+        text = repr(float(value))
+    elif tag in "tTdh":
+        text = value.isoformat()
+    else:
+        text = str(value)
+    return f"{tag}:{text}"
 
 
-async def load_images(submissions, media_images, image_data):
-    submission_images = []
-    tasks = []
-
-    for _, row in submissions.iterrows():
-        task = asyncio.create_task(
-            load_image(row.match_image_file_index, media_images, image_data)
-        )
-        tasks.append(task)
+def _decode_cache_cell(value):
+    if value is None:
+        return None
+    tag, text = value.split(":", 1)
+    return _CACHE_CELL_DECODERS[tag](text)
+
+
+def _submissions_to_parquet(submissions) -> io.BytesIO:
+    """Serializes the submissions for the cache, keeping the types of all the cells"""
+    if not submissions.columns.is_unique:
+        raise ValueError("Submissions with duplicate columns cannot be cached")
+    object_columns = [
+        column for column, dtype in submissions.dtypes.items() if dtype == object
+    ]
+    encoded = submissions.assign(
+        **{
+            column: submissions[column].map(_encode_cache_cell)
+            for column in object_columns
+        }
+    )
+    encoded.attrs = {"encoded_columns": object_columns}
+    buffer = io.BytesIO()
+    encoded.to_parquet(buffer)
+    return buffer
 
-    submission_images = await asyncio.gather(*tasks)
 
-    return submission_images
+def _submissions_from_parquet(data) -> pd.DataFrame:
+    """Reads submissions serialized by _submissions_to_parquet"""
+    submissions = pd.read_parquet(io.BytesIO(data))
+    for column in submissions.attrs.pop("encoded_columns"):
+        submissions[column] = submissions[column].map(_decode_cache_cell)
+    return submissions
 
 
 class Project:
@@ -77,17 +186,70 @@ class Project:
         access_token: str,
         working_dir: str = "./workdir",
         az_connection_string: str = os.getenv("AZURE_STORAGE_CONNECTION_STRING"),
+        download_attachments: bool = True,
+        azure_storage: Optional[AzureStorage] = None,
     ) -> "Project":
-        azure_blob_handler = AzureStorage(az_connection_string)
+        """
+        Creates the project from its attachments in the container.
+        The parsed submissions are cached per version of the attachments, so each version is parsed once.
+        If download_attachments is False, the attachments are only downloaded when the submissions
+        are not cached yet. Only use it when process_data will not be called.
+        An existing AzureStorage can be passed to reuse its connections.
+        """
+        azure_blob_handler = azure_storage or AzureStorage(az_connection_string)
         attachment_dir = os.path.join(working_dir, "submissions")
-        # Fetches all files from the folders in the container
-        azure_blob_handler.fetch_files_from_folder(
-            input_container_path, project_path, attachment_dir
+
+        input_blobs = azure_blob_handler.list_blobs_in_folder(
+            input_container_path, project_path
         )
+        cache_blob_name = f"{_blobs_fingerprint(input_blobs)}-v{CACHE_VERSION}.parquet"
+        cached_submissions = azure_blob_handler.download_blob_bytes(
+            CACHE_CONTAINER, f"{project_path}/{cache_blob_name}"
+        )
+        submissions = None
+        if cached_submissions is not None:
+            try:
+                submissions = _submissions_from_parquet(cached_submissions)
+                logger.info(f"Using cached submissions for {project_path}")
+            except (OSError, ValueError, TypeError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable cached submissions: {e}")
+
+        if submissions is None or download_attachments:
+            # Fetches all files from the folders in the container, all at once
+            blob_names = [
+                blob.name for blob in input_blobs if not blob.name.endswith("/")
+            ]
+            if blob_names:
+                run_async(
+                    _download_blobs(
+                        azure_blob_handler.connection_string,
+                        input_container_path,
+                        blob_names,
+                        attachment_dir,
+                    )
+                )
+
+        project = Project(working_dir, project_path, access_token, submissions)
+
+        if submissions is None:
+            try:
+                buffer = _submissions_to_parquet(project.submissions)
+                azure_blob_handler.create_container(CACHE_CONTAINER)
+                azure_blob_handler.upload_stream_to_folder(
+                    CACHE_CONTAINER, project_path, buffer, cache_blob_name
+                )
+            except (AzureError, ValueError, TypeError, NotImplementedError) as e:
+                logger.warning(f"Unable to cache submissions for {project_path}: {e}")
 
-        return Project(working_dir, project_path, access_token)
+        return project
 
-    def __init__(self, submissions_path: str, project_path: str, access_token: str) -> None:
+    def __init__(
+        self,
+        submissions_path: str,
+        project_path: str,
+        access_token: str,
+        submissions: Optional[pd.DataFrame] = None,
+    ) -> None:
         self.files = []
         self.submissions: pd.DataFrame = None
         self.submissions_path = submissions_path
@@ -107,36 +269,39 @@ class Project:
             status="Active",
             client="",
         )
-        self._process_vendor_submissions()
+        if submissions is None:
+            self._process_vendor_submissions()
+        else:
+            # Already processed submissions, e.g. from the cache
+            self.submissions = submissions
+            self._register_vendor()
 
     def _process_vendor_submissions(self) -> pd.DataFrame:
         xlsx_files = glob.glob(
             os.path.join(self.submissions_path, "**", "*.xlsx"), recursive=True
         )
 
-        all_dfs = []
-        for file in xlsx_files:
-            logger.info(f"Processing {file} for vendor submissions")
-            target_sheets, header_rows = detect_sheet_and_header(file)
-
-            logger.debug(f"{file}\n has {len(target_sheets)} sheets.")
-
-            if not target_sheets:
-                logger.info(f"Warning: No suitable sheet found in {file}. Skipping.")
-                continue
-
-            # Extract all images from the .xlsx file
-            all_images = extract_images_to_dict(file)
-            # Call append_images_to_df to get a dictionary of DataFrames
-            data_dict = append_images_to_df(
-                file, target_sheets, header_rows, all_images
-            )
+        # Files are independent, so process them in parallel when there are several.
+        # The workers are started from a fork server, since forking this process would
+        # copy the state of its threads (the event loop of run_async, worker threads)
+        if len(xlsx_files) > 1:
+            with ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context("forkserver"),
+            ) as executor:
+                results = list(executor.map(_process_one_xlsx, xlsx_files))
+        else:
+            results = [_process_one_xlsx(file) for file in xlsx_files]
 
-            # Extract the DataFrames from the dictionary and append them to all_df
-            data_dfs = list(data_dict.values())
-            all_dfs.extend(data_dfs)
+        all_dfs = [data_df for data_dfs in results for data_df in data_dfs]
 
-        self.submissions = pd.concat(all_dfs, axis=0, ignore_index=True)
+        # Vendor sheets have different columns, so align them all to the union of
+        # columns (in order of appearance) before concatenating them in one go
+        all_columns = list(
+            dict.fromkeys(column for data_df in all_dfs for column in data_df.columns)
+        )
+        all_dfs = [data_df.reindex(columns=all_columns) for data_df in all_dfs]
+        self.submissions = pd.concat(all_dfs, axis=0, ignore_index=True, copy=False)
         if (
             "Unit #" in self.submissions.columns
             and self.submissions["Unit #"].notnull().any()
@@ -147,7 +312,13 @@ class Project:
 
         self.submissions = self.submissions.assign(image_matched=False)
         self.submissions = self.submissions.assign(match_image_index=-1)
+        # Few distinct vendors, so a categorical makes the per-vendor groupbys cheap
+        if "Vendor" in self.submissions.columns:
+            self.submissions["Vendor"] = self.submissions["Vendor"].astype("category")
         logger.info(f"Total combined submissions: {self.submissions.shape[0]}")
+        self._register_vendor()
+
+    def _register_vendor(self):
         # Upload the final submission to the database
         # access_token = os.getenv("ACCESS_TOKEN")
         headers = {
@@ -162,7 +333,7 @@ class Project:
         )
 
     def process_data(
-        self, Azure_Connection_String,container_name="images", unit_number=None
+        self, Azure_Connection_String, container_name="images", unit_number=None
     ):
         all_links = fetch_files_and_extract_links(self.submissions_path)
         classified_links_dict = classify_all_links(all_links)
@@ -220,18 +391,29 @@ class Project:
         match_media_type(self.submissions, pdf_data["content"])
         self.submissions["bus_media"] = -1
         match_bus_media(self.submissions)
-        submission_images = []
-        for _, row in self.submissions.iterrows():
-            if row.match_image_index != -1:
-                submission_images.append(media_images[row.match_image_index])
-            elif row.match_image_file_index != -1:
-                submission_images.append(
-                    image_data["images"][row.match_image_file_index]
-                )
-            elif row.bus_media != -1:
-                submission_images.append(random.choice(bus_images))
-            else:
-                submission_images.append(None)
+        # Pick the pdf image, then the image file, then a bus image for every row
+        pdf_image_index = self.submissions["match_image_index"].to_numpy(dtype=int)
+        file_image_index = self.submissions["match_image_file_index"].to_numpy(
+            dtype=int
+        )
+        images_lookup = media_images + image_data["images"] + [None]
+        image_index = np.where(
+            pdf_image_index != -1,
+            pdf_image_index,
+            np.where(
+                file_image_index != -1,
+                len(media_images) + file_image_index,
+                len(images_lookup) - 1,
+            ),
+        )
+        submission_images = [images_lookup[idx] for idx in image_index]
+        bus_rows = np.flatnonzero(
+            (pdf_image_index == -1)
+            & (file_image_index == -1)
+            & (self.submissions["bus_media"].to_numpy() != -1)
+        )
+        for idx in bus_rows:
+            submission_images[idx] = random.choice(bus_images)
         final_submission = clean_up(self.submissions)
         # Upload the final submission to the database
         # access_token = os.getenv("ACCESS_TOKEN")
@@ -239,15 +421,19 @@ class Project:
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json",
         }
-        uploaded_filenames1 = AzureStorage.upload_images_to_azure(submission_images,container_name,Azure_Connection_String)    
-        images_to_upload = []
         # Collect images from rows
-        for idx, row in final_submission.iterrows():
-            if isinstance(row["Images"], bytes):
-                images_to_upload.append(row["Images"])
-
-        # Upload images and get filenames
-        uploaded_filenames2 = AzureStorage.upload_images_to_azure(images_to_upload, container_name,Azure_Connection_String)
+        images_to_upload = [
+            image for image in final_submission["Images"] if isinstance(image, bytes)
+        ]
+
+        # Upload the matched and the row images in one batch and get filenames
+        uploaded_filenames = AzureStorage.upload_images_to_azure(
+            submission_images + images_to_upload,
+            container_name,
+            Azure_Connection_String,
+        )
+        uploaded_filenames1 = uploaded_filenames[: len(submission_images)]
+        uploaded_filenames2 = uploaded_filenames[len(submission_images) :]
 
         # Replace image data in rows with filenames
         for idx, filename in enumerate(uploaded_filenames1):
@@ -257,10 +443,7 @@ class Project:
         submission_endpoint = f"/projects/{self.wilkins_id}/submissions"  # Replace with your actual project ID
         base_url = os.getenv("BASE_URL")
         submission_url = f"{base_url}{submission_endpoint}"
-        # Perform asynchronous image loading
-        # loop = asyncio.get_event_loop()
-        # submission_images = loop.run_until_complete(load_images(self.submissions, media_images, image_data))
-        asyncio.run(create_submission(final_submission, headers, submission_url))
+        run_async(create_submission(final_submission, headers, submission_url))
         # return final_submission
 
     def create_ppt(self, submission_data, output_file_path,azure_storage, container_name = "images", template_path="template.pptx"):
@@ -268,10 +451,12 @@ class Project:
         ppt.create_presentation(output_file_path,azure_storage,container_name)
 
     def create_excel(self, submission_data, output_file_path):
-        # Check if the directory of the output file exists, if not, create it
-        output_dir = os.path.dirname(output_file_path)
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        """Writes the submissions to an Excel file, given as a path or a file-like object"""
+        if isinstance(output_file_path, str):
+            # Check if the directory of the output file exists, if not, create it
+            output_dir = os.path.dirname(output_file_path)
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
 
         # Write the DataFrame to an Excel file
         submission_data.to_excel(output_file_path)
@@ -283,20 +468,31 @@ class Project:
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        # Create a temporary directory
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Check and copy each file into the temporary directory
+        # Write each file straight into the zip
+        with zipfile.ZipFile(
+            output_zip_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1
+        ) as zipf:
             for file_path in [file1_path, file2_path]:
                 if os.path.exists(file_path):
-                    shutil.copy(file_path, temp_dir)
+                    zipf.write(file_path, arcname=os.path.basename(file_path))
                 else:
-                    logger.warning(f"Warning: {file_path} does not exist and will not be included in the zip.")
-
-            # Zip the temporary folder
-            with zipfile.ZipFile(output_zip_path, 'w') as zipf:
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        zipf.write(file_path, os.path.relpath(file_path, temp_dir))
-
-        logger.info(f'Files zipped at {output_zip_path}')
\ No newline at end of file
+                    logger.warning(
+                        f"Warning: {file_path} does not exist and will not be included in the zip."
+                    )
+
+        logger.info(f"Files zipped at {output_zip_path}")
+
+    def zip_streams(self, streams, output_zip):
+        """
+        Zip in-memory files without writing them to disk.
+
+        :param streams: Dictionary of file names in the archive and their io.BytesIO objects.
+        :param output_zip: The path or file-like object to write the zip to.
+        """
+        with zipfile.ZipFile(
+            output_zip, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1
+        ) as zipf:
+            for file_name, stream in streams.items():
+                zipf.writestr(file_name, stream.getvalue())
+
+        logger.info(f"Files zipped: {list(streams)}")
\ No newline at end of file
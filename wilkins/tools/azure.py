@@ -1,4 +1,5 @@
 import os
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
 from azure.storage.blob import (
     BlobServiceClient,
     generate_blob_sas,
@@ -6,6 +7,9 @@ from azure.storage.blob import (
     BlobClient,
     ContainerClient,
 )
+from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+import asyncio
+import threading
 import logging
 import uuid
 from PIL import Image
@@ -14,53 +18,210 @@ import io
 from boxsdk import Client, JWTAuth
 from boxsdk.exception import BoxAPIException
 import json
-import re
+import hashlib
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from functools import lru_cache
+from urllib.parse import quote
 logger = logging.getLogger(__name__)
 
+# Number of concurrent blob transfers (or chunks of one large blob), and of pooled
+# HTTP connections to serve them
+MAX_CONNECTIONS = 16
+# Number of concurrent blob transfers awaited by AsyncAzureStorage on one event loop
+MAX_ASYNC_TRANSFERS = 64
+# Maximum number of blobs in one batch request
+BLOB_BATCH_SIZE = 256
+# Files picked up when uploading the images of a directory
+IMAGE_EXTENSIONS = ("png", "jpg", "jpeg", "gif", "bmp")
+
+
+def _create_http_session():
+    """Creates a requests session whose connection pool fits MAX_CONNECTIONS workers"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@lru_cache(maxsize=8)
+def _get_blob_service_client(connection_string):
+    """Returns the BlobServiceClient shared by callers with this connection string"""
+    return BlobServiceClient.from_connection_string(
+        connection_string, session=_create_http_session()
+    )
+
+
+@lru_cache(maxsize=64)
+def _get_container_client(connection_string, container_name):
+    """Returns a client for the container, creating the container if it is missing"""
+    container_client = _get_blob_service_client(connection_string).get_container_client(
+        container_name
+    )
+    try:
+        container_client.create_container()
+    except ResourceExistsError:
+        # Already there, which is the usual case
+        pass
+    return container_client
+
+
+@lru_cache(maxsize=1)
+def _get_box_client():
+    """Returns a Box client authenticated with the JWT settings in config.json"""
+    with open("config.json", "r") as config_file:
+        config = json.load(config_file)
+    auth = JWTAuth.from_settings_dictionary(config)
+    return Client(auth)
+
+
+# Characters Box does not allow in item names, replaced by "_"
+_BOX_NAME_TRANSLATION = str.maketrans({char: "_" for char in '/\\:*?"<>|'})
+
+
+def _delete_blobs_in_batches(container_client, blob_names):
+    """Deletes the blobs with one request per BLOB_BATCH_SIZE blobs"""
+    for start in range(0, len(blob_names), BLOB_BATCH_SIZE):
+        container_client.delete_blobs(*blob_names[start : start + BLOB_BATCH_SIZE])
+
+
+_thread_buffers = threading.local()
+
+
+def _thread_buffer():
+    """Returns this thread's reusable buffer for encoding images, rewound"""
+    buffer = getattr(_thread_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _thread_buffers.buffer = io.BytesIO()
+    buffer.seek(0)
+    return buffer
+
+
+def _image_digest(image):
+    """Returns a content hash identifying the image, or None if it is not an image"""
+    if isinstance(image, str):
+        with open(image, "rb") as image_file:
+            data = image_file.read()
+    elif isinstance(image, bytes):
+        data = image
+    elif isinstance(image, Image.Image):
+        # Palette images with the same pixels but different colors are different
+        palette = image.getpalette() or []
+        transparency = image.info.get("transparency")
+        header = f"{image.mode}{image.size}{transparency!r}".encode()
+        data = header + bytes(palette) + image.tobytes()
+    else:
+        return None
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
 
 class AzureStorage:
     def __init__(self, connection_string):
         self.connection_string = connection_string
+        # Containers known to exist, which create_container does not need to check again
+        self.known_containers = set()
+        self.session = _create_http_session()
         self.blob_service_client = BlobServiceClient.from_connection_string(
-            connection_string
+            connection_string,
+            session=self.session,
+            max_single_get_size=4 * 1024 * 1024,
+            max_chunk_get_size=4 * 1024 * 1024,
+            max_single_put_size=4 * 1024 * 1024,
+            max_block_size=4 * 1024 * 1024,
+        )
+        self._blob_clients = lru_cache(maxsize=4096)(
+            self.blob_service_client.get_blob_client
         )
 
-    def upload_file(self, container_name, file_path, blob_name=None):
+    def get_blob_client(self, container_name, blob_name):
+        """Returns the client of a blob, reusing the one built for an earlier call"""
+        return self._blob_clients(container_name, blob_name)
+
+    def upload_file(
+        self, container_name, file_path, blob_name=None, max_concurrency=MAX_CONNECTIONS
+    ):
         if blob_name is None:
             blob_name = os.path.basename(file_path)
 
-        blob_client = self.blob_service_client.get_blob_client(
-            container=container_name, blob=blob_name
-        )
+        blob_client = self.get_blob_client(container_name, blob_name)
 
         with open(file_path, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
+            blob_client.upload_blob(
+                data, overwrite=True, max_concurrency=max_concurrency
+            )
             logger.info(f"Uploaded {file_path} to {container_name}/{blob_name}")
 
-    def download_file(self, container_name, blob_name, download_folder):
-        blob_client = self.blob_service_client.get_blob_client(
-            container=container_name, blob=blob_name
-        )
+    def download_file(
+        self,
+        container_name,
+        blob_name,
+        download_folder,
+        max_concurrency=MAX_CONNECTIONS,
+    ):
+        blob_client = self.get_blob_client(container_name, blob_name)
         download_file_path = os.path.join(download_folder, blob_name.replace("/", "_"))
 
         os.makedirs(download_folder, exist_ok=True)
 
         with open(download_file_path, "wb") as download_file:
-            download_file.write(blob_client.download_blob().readall())
+            blob_client.download_blob(max_concurrency=max_concurrency).readinto(
+                download_file
+            )
             logger.info(
                 f"Downloaded {container_name}/{blob_name} to {download_file_path}"
             )
 
-    def _download_all_blobs(self, container_name, download_folder):
+    def _download_all_blobs(
+        self, container_name, download_folder, max_workers=MAX_CONNECTIONS
+    ):
         container_client = self.blob_service_client.get_container_client(container_name)
-        blobs = container_client.list_blobs()
-        for blob in blobs:
-            self.download_file(container_name, blob.name, download_folder)
+        blob_names = container_client.list_blob_names()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    self.download_file, container_name, blob_name, download_folder
+                )
+                for blob_name in blob_names
+            ]
+            for future in futures:
+                future.result()
+
+    def list_blobs_in_folder(self, container_name, folder_prefix):
+        """
+        List the properties of all blobs within a specific folder in a container.
+
+        :param container_name: Name of the Azure storage container.
+        :param folder_prefix: The folder path within the container.
+        :return: List of blob properties.
+        """
+        container_client = self.blob_service_client.get_container_client(container_name)
+        return list(container_client.list_blobs(name_starts_with=folder_prefix))
+
+    def download_blob_bytes(
+        self, container_name, blob_name, max_concurrency=MAX_CONNECTIONS
+    ):
+        """
+        Download the content of a blob into memory.
+
+        :param container_name: Name of the Azure storage container.
+        :param blob_name: The name of the blob in the container.
+        :param max_concurrency: Number of chunks of a large blob to download in parallel.
+        :return: The blob content, or None if the blob does not exist.
+        """
+        blob_client = self.get_blob_client(container_name, blob_name)
+        try:
+            return blob_client.download_blob(max_concurrency=max_concurrency).readall()
+        except ResourceNotFoundError:
+            return None
 
     def list_blobs_in_container(self, container_name):
         container_client = self.blob_service_client.get_container_client(container_name)
-        blob_list = container_client.list_blobs()
-        return [blob.name for blob in blob_list]
+        return list(container_client.list_blob_names())
 
     def all_blobs_in_container(self, container_name):
         container_client = self.blob_service_client.get_container_client(container_name)
@@ -73,14 +234,16 @@ class AzureStorage:
             container_client = self.blob_service_client.get_container_client(
                 container_name
             )
+            if container_name in self.known_containers:
+                return container_client
 
-            # Check if the container already exists
-            if not container_client.exists():
-                # Create new container
+            # Create the container, unless it already exists
+            try:
                 container_client.create_container()
                 logger.info(f"Container '{container_name}' created.")
-            else:
+            except ResourceExistsError:
                 logger.info(f"Container '{container_name}' already exists.")
+            self.known_containers.add(container_name)
 
             return container_client
         except Exception as e:
@@ -88,27 +251,39 @@ class AzureStorage:
             return None
 
     def getBlobClient(self, container_name, blob):
-        return self.blob_service_client.get_blob_client(
-            container=container_name, blob=blob.name
-        )
-
-    def process_blobs_recursive(self, container_name, prefix="", process_function=None):
+        return self.get_blob_client(container_name, blob.name)
+
+    def process_blobs_recursive(
+        self,
+        container_name,
+        prefix="",
+        process_function=None,
+        max_workers=MAX_CONNECTIONS,
+    ):
         """
         Recursively process all blobs starting with a given prefix.
 
         :param container_name: Name of the Azure storage container.
         :param prefix: Prefix to filter blobs to process.
         :param process_function: A function to call with each blob name. If None, it will logging.info the blob names.
+        :param max_workers: Number of blobs processed concurrently by process_function, which must be thread-safe.
         """
         container_client = self.blob_service_client.get_container_client(container_name)
         blob_list = container_client.list_blobs(name_starts_with=prefix, delimiter="/")
-        for blob in blob_list:
-            # Process only if it's not a "folder"
-            if not blob.name.endswith("/"):
-                if process_function:
-                    process_function(container_name, blob.name)
-                else:
-                    logging.info(f"Blob found: {blob.name}")
+        # Process only if it's not a "folder"
+        blob_names = [blob.name for blob in blob_list if not blob.name.endswith("/")]
+        if not process_function:
+            for blob_name in blob_names:
+                logging.info(f"Blob found: {blob_name}")
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(process_function, container_name, blob_name)
+                for blob_name in blob_names
+            ]
+            for future in futures:
+                future.result()
 
     def fetch_files_from_folder(
         self, container_name, folder_prefix, download_folder=None
@@ -121,19 +296,90 @@ class AzureStorage:
         :param download_folder: The local folder where the files should be downloaded (optional).
         """
         container_client = self.blob_service_client.get_container_client(container_name)
-        blob_iter = container_client.list_blobs(name_starts_with=folder_prefix)
+        blob_iter = container_client.list_blob_names(name_starts_with=folder_prefix)
 
         # Iterate through the blobs in the folder
-        for blob in blob_iter:
+        blob_names = []
+        for blob_name in blob_iter:
             # This ensures we skip "folders" and only process "files"
-            if not blob.name.endswith("/"):
-                logger.info(f"Found blob: {blob.name}")
-                if download_folder:
-                    # If a download folder is provided, download the file
-                    self.download_file(container_name, blob.name, download_folder)
+            if not blob_name.endswith("/"):
+                logger.info(f"Found blob: {blob_name}")
+                blob_names.append(blob_name)
+
+        if download_folder and blob_names:
+            # If a download folder is provided, download the files concurrently
+            os.makedirs(download_folder, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=MAX_CONNECTIONS) as executor:
+                futures = [
+                    executor.submit(
+                        self.download_file, container_name, blob_name, download_folder
+                    )
+                    for blob_name in blob_names
+                ]
+                for future in futures:
+                    future.result()
+
+    def get_blob_properties(self, container_name, blob_name):
+        """
+        Fetch the properties of a blob with a single HEAD request.
+
+        :param container_name: Name of the Azure storage container.
+        :param blob_name: The name of the blob in the container.
+        :return: The blob properties, or None if the blob does not exist.
+        """
+        blob_client = self.get_blob_client(container_name, blob_name)
+        try:
+            return blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+
+    def delete_blobs_bulk(self, container_name, blob_names):
+        """
+        Delete blobs with batch requests of up to BLOB_BATCH_SIZE blobs each.
+
+        :param container_name: Name of the Azure storage container.
+        :param blob_names: The names of the blobs in the container.
+        """
+        container_client = self.blob_service_client.get_container_client(container_name)
+        _delete_blobs_in_batches(container_client, list(blob_names))
+        logger.info(f"Deleted {len(blob_names)} blobs from {container_name}")
+
+    def set_blobs_tier_bulk(self, container_name, blob_names, tier):
+        """
+        Set the access tier of block blobs with batch requests of up to BLOB_BATCH_SIZE blobs each.
+
+        :param container_name: Name of the Azure storage container.
+        :param blob_names: The names of the blobs in the container.
+        :param tier: The standard blob tier, e.g. "Hot", "Cool" or "Archive".
+        """
+        container_client = self.blob_service_client.get_container_client(container_name)
+        blob_names = list(blob_names)
+        for start in range(0, len(blob_names), BLOB_BATCH_SIZE):
+            container_client.set_standard_blob_tier_blobs(
+                tier, *blob_names[start : start + BLOB_BATCH_SIZE]
+            )
+        logger.info(f"Set {len(blob_names)} blobs in {container_name} to {tier}")
+
+    def folder_last_modified(self, container_name, folder_prefix):
+        """
+        Find when the most recently modified blob within a specific folder was modified.
+
+        :param container_name: Name of the Azure storage container.
+        :param folder_prefix: The folder path within the container.
+        :return: The newest last modified time, or None if the folder is empty.
+        """
+        container_client = self.blob_service_client.get_container_client(container_name)
+        blob_list = container_client.list_blobs(name_starts_with=folder_prefix)
+        return max((blob.last_modified for blob in blob_list), default=None)
 
     def upload_file_to_folder(
-        self, container_name, folder_path, file_path, blob_name=None
+        self,
+        container_name,
+        folder_path,
+        file_path,
+        blob_name=None,
+        metadata=None,
+        max_concurrency=MAX_CONNECTIONS,
     ):
         """
         Upload a file to a specific folder within a container.
@@ -142,6 +388,8 @@ class AzureStorage:
         :param folder_path: The folder path within the container where the file will be uploaded.
         :param file_path: The local path to the file.
         :param blob_name: The blob name. If None, the file name will be used.
+        :param metadata: Optional. Metadata to set on the uploaded blob.
+        :param max_concurrency: Number of blocks of a large file to upload in parallel.
         """
         if not folder_path.endswith("/"):
             folder_path += "/"
@@ -151,132 +399,207 @@ class AzureStorage:
 
         # Prefix the blob_name with the folder path
         full_blob_name = f"{folder_path}{blob_name}"
-        blob_client = self.blob_service_client.get_blob_client(
-            container=container_name, blob=full_blob_name
-        )
+        blob_client = self.get_blob_client(container_name, full_blob_name)
 
         with open(file_path, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
+            blob_client.upload_blob(
+                data,
+                overwrite=True,
+                metadata=metadata,
+                max_concurrency=max_concurrency,
+            )
             logger.info(f"Uploaded {file_path} to {container_name}/{full_blob_name}")
 
-    def generate_powerpoint_sas_urls(self, container_name, project, expiry_hours=24):
+    def upload_stream_to_folder(
+        self,
+        container_name,
+        folder_path,
+        stream,
+        blob_name,
+        metadata=None,
+        max_concurrency=MAX_CONNECTIONS,
+    ):
         """
-        Generate SAS URLs for all PowerPoint files in the specified container.
+        Upload the whole content of an in-memory stream to a specific folder within a container.
 
         :param container_name: Name of the Azure storage container.
+        :param folder_path: The folder path within the container where the stream will be uploaded.
+        :param stream: A seekable file-like object, e.g. io.BytesIO.
+        :param blob_name: The blob name.
+        :param metadata: Optional. Metadata to set on the uploaded blob.
+        :param max_concurrency: Number of blocks of a large stream to upload in parallel.
+        """
+        if not folder_path.endswith("/"):
+            folder_path += "/"
+
+        full_blob_name = f"{folder_path}{blob_name}"
+        blob_client = self.get_blob_client(container_name, full_blob_name)
+
+        stream.seek(0)
+        blob_client.upload_blob(
+            stream,
+            overwrite=True,
+            metadata=metadata,
+            max_concurrency=max_concurrency,
+        )
+        logger.info(f"Uploaded {blob_name} to {container_name}/{full_blob_name}")
+
+    def generate_blob_sas_url(self, container_name, blob_name, expiry_hours=24):
+        """
+        Generate a read-only SAS URL for a single blob, without listing the container.
+
+        :param container_name: Name of the Azure storage container.
+        :param blob_name: The name of the blob in the container.
         :param expiry_hours: The number of hours for which the SAS URL will be valid.
-        :return: A dictionary of PowerPoint file names and their SAS URLs.
+        :return: The SAS URL of the blob.
+        """
+        account_name = self.blob_service_client.account_name
+        sas_blob = generate_blob_sas(
+            account_name=account_name,
+            container_name=container_name,
+            blob_name=blob_name,
+            account_key=self.blob_service_client.credential.account_key,
+            permission=BlobSasPermissions(read=True),
+            expiry=datetime.utcnow() + timedelta(hours=expiry_hours),
+        )
+        return f"https://{account_name}.blob.core.windows.net/{container_name}/{quote(blob_name)}?{sas_blob}"
+
+    def generate_sas_urls(self, container_name, project, extensions, expiry_hours=24):
+        """
+        Generate SAS URLs for all files of the given types in a project folder.
+
+        :param container_name: Name of the Azure storage container.
+        :param project: The project folder within the container.
+        :param extensions: Tuple of lowercase file extensions to include, e.g. (".xlsx", ".xls").
+        :param expiry_hours: The number of hours for which the SAS URLs will be valid.
+        :return: A dictionary of file names and their SAS URLs.
+        """
+        return self.generate_sas_urls_by_type(
+            container_name, project, {"files": extensions}, expiry_hours
+        )["files"]
+
+    def generate_sas_urls_by_type(
+        self, container_name, project, extensions_by_type, expiry_hours=24
+    ):
+        """
+        Generate SAS URLs for several file types in a project folder, listing it once.
+
+        :param container_name: Name of the Azure storage container.
+        :param project: The project folder within the container.
+        :param extensions_by_type: Dictionary of file types and tuples of their lowercase
+            extensions, e.g. {"ppt": (".ppt", ".pptx"), "zip": (".zip",)}.
+        :param expiry_hours: The number of hours for which the SAS URLs will be valid.
+        :return: A dictionary of file types and dictionaries of file names and their SAS URLs.
         """
-        powerpoint_sas_urls = {}
+        sas_urls = {file_type: {} for file_type in extensions_by_type}
         container_client = self.blob_service_client.get_container_client(container_name)
-        blob_list = container_client.list_blobs(name_starts_with=project)
+        blob_names = container_client.list_blob_names(
+            name_starts_with=f"{project.rstrip('/')}/"
+        )
 
-        for blob in blob_list:
-            if blob.name.lower().endswith((".ppt", ".pptx")):
+        # These are the same for every blob
+        account_name = self.blob_service_client.account_name
+        account_key = self.blob_service_client.credential.account_key
+        permission = BlobSasPermissions(read=True)
+        expiry = datetime.utcnow() + timedelta(hours=expiry_hours)
+        url_prefix = f"https://{account_name}.blob.core.windows.net/{container_name}"
+
+        for blob_name in blob_names:
+            blob_name_lower = blob_name.lower()
+            for file_type, extensions in extensions_by_type.items():
+                if not blob_name_lower.endswith(extensions):
+                    continue
                 sas_blob = generate_blob_sas(
-                    account_name=self.blob_service_client.account_name,
+                    account_name=account_name,
                     container_name=container_name,
-                    blob_name=blob.name,
-                    account_key=self.blob_service_client.credential.account_key,
-                    permission=BlobSasPermissions(read=True),
-                    expiry=datetime.utcnow() + timedelta(hours=expiry_hours),
+                    blob_name=blob_name,
+                    account_key=account_key,
+                    permission=permission,
+                    expiry=expiry,
                 )
-                sas_url = f"https://{self.blob_service_client.account_name}.blob.core.windows.net/{container_name}/{blob.name}?{sas_blob}"
-                powerpoint_sas_urls[blob.name] = sas_url
+                sas_url = f"{url_prefix}/{quote(blob_name)}?{sas_blob}"
+                sas_urls[file_type][blob_name] = sas_url
+
+        return sas_urls
+
+    def generate_powerpoint_sas_urls(self, container_name, project, expiry_hours=24):
+        """
+        Generate SAS URLs for all PowerPoint files in the specified container.
+
+        :param container_name: Name of the Azure storage container.
+        :param expiry_hours: The number of hours for which the SAS URL will be valid.
+        :return: A dictionary of PowerPoint file names and their SAS URLs.
+        """
+        return self.generate_sas_urls(
+            container_name, project, (".ppt", ".pptx"), expiry_hours
+        )
 
-        return powerpoint_sas_urls
-    
     def generate_excel_sas_urls(self, container_name, project, expiry_hours=24):
         """
         Generate SAS URLs for all Excel files in the specified container.
         """
-        excel_sas_urls = {}
-        container_client = self.blob_service_client.get_container_client(container_name)
-        blob_list = container_client.list_blobs(name_starts_with=project)
-
-        for blob in blob_list:
-            if blob.name.lower().endswith((".xlsx", ".xls")):
-                sas_blob = generate_blob_sas(
-                    account_name=self.blob_service_client.account_name,
-                    container_name=container_name,
-                    blob_name=blob.name,
-                    account_key=self.blob_service_client.credential.account_key,
-                    permission=BlobSasPermissions(read=True),
-                    expiry=datetime.utcnow() + timedelta(hours=expiry_hours),
-                )
-                sas_url = f"https://{self.blob_service_client.account_name}.blob.core.windows.net/{container_name}/{blob.name}?{sas_blob}"
-                excel_sas_urls[blob.name] = sas_url
+        return self.generate_sas_urls(
+            container_name, project, (".xlsx", ".xls"), expiry_hours
+        )
 
-        return excel_sas_urls
-    
     def generate_zip_sas_urls(self, container_name, project, expiry_hours=24):
         """
         Generate SAS URLs for all ZIP files in the specified container.
         """
-        zip_sas_urls = {}
-        container_client = self.blob_service_client.get_container_client(container_name)
-        blob_list = container_client.list_blobs(name_starts_with=project)
+        return self.generate_sas_urls(container_name, project, (".zip",), expiry_hours)
 
-        for blob in blob_list:
-            if blob.name.lower().endswith(".zip"):
-                sas_blob = generate_blob_sas(
-                    account_name=self.blob_service_client.account_name,
-                    container_name=container_name,
-                    blob_name=blob.name,
-                    account_key=self.blob_service_client.credential.account_key,
-                    permission=BlobSasPermissions(read=True),
-                    expiry=datetime.utcnow() + timedelta(hours=expiry_hours),
-                )
-                sas_url = f"https://{self.blob_service_client.account_name}.blob.core.windows.net/{container_name}/{blob.name}?{sas_blob}"
-                zip_sas_urls[blob.name] = sas_url
-
-        return zip_sas_urls
-    
-    def get_image_as_pil(self, container_name, blob_name):
+    def get_image_as_pil(
+        self, container_name, blob_name, max_concurrency=MAX_CONNECTIONS
+    ):
         """
         Fetches an image from Azure Blob Storage and returns it as a PIL Image object.
 
         :param container_name: The name of the Azure Blob Storage container.
         :param blob_name: The name of the blob (image) in the container.
+        :param max_concurrency: Number of chunks of a large image to download in parallel.
         :return: PIL Image object.
         """
-        blob_client = self.blob_service_client.get_blob_client(
-            container=container_name, blob=blob_name
-        )
-        stream = io.BytesIO(blob_client.download_blob().readall())
+        blob_client = self.get_blob_client(container_name, blob_name)
+        # Download straight into the buffer PIL reads from, without an extra copy
+        stream = io.BytesIO()
+        blob_client.download_blob(max_concurrency=max_concurrency).readinto(stream)
+        stream.seek(0)
         return Image.open(stream)
     
     @staticmethod
     def upload_images_to_azure(images, container_name, connection_string, path=None):
         """
-        Uploads images to an Azure Blob Storage container with unique UUIDs as filenames.
+        Uploads images to an Azure Blob Storage container, named after a hash of their content.
+        Identical images are uploaded once and share a filename, and images already in the container are not uploaded again.
         If a path is provided, images are read from the path. Otherwise, images from the provided list are used.
-        
+
         :param images: List of images (PIL Image objects or bytes). Used if path is None.
         :param container_name: The name of the Azure Blob Storage container.
         :param connection_string: Your Azure Storage Account connection string.
         :param path: Optional. Path to a directory containing images or a single image file.
-        :return: List of filenames with UUIDs.
+        :return: List of filenames, None for entries that are not images.
         """
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        blob_service_client = _get_blob_service_client(connection_string)
 
         # Create a container if it doesn't exist
-        container_client = blob_service_client.get_container_client(container_name)
-        if not container_client.exists():
-            container_client.create_container()
-
-        uploaded_filenames = []
+        _get_container_client(connection_string, container_name)
 
         # Process images from the path if provided
         if path:
             if os.path.isdir(path):
-                images = [os.path.join(path, file) for file in os.listdir(path) if file.lower().endswith(('png', 'jpg', 'jpeg', 'gif', 'bmp'))]
+                with os.scandir(path) as entries:
+                    images = [
+                        entry.path
+                        for entry in entries
+                        if entry.name.lower().endswith(IMAGE_EXTENSIONS)
+                        and entry.is_file()
+                    ]
             elif os.path.isfile(path):
                 images = [path]
             else:
                 raise ValueError("Provided path is neither a directory nor a file.")
 
-        for img_path in images:
+        def upload_one(digest, img_path):
             if isinstance(img_path, str):
                 # Open image from a file path
                 image = Image.open(img_path)
@@ -286,31 +609,62 @@ class AzureStorage:
             elif isinstance(img_path, Image.Image):
                 # Use the image directly if it's already a PIL Image
                 image = img_path
-            else:    
-                uploaded_filenames.append(None)
-                continue
-
+            else:
+                return None
 
             # Handle RGBA to RGB conversion if necessary
-            if image.mode == 'RGBA':
-                image = image.convert('RGB')
-
-            # Generate a unique filename using UUID
-            filename = f"{uuid.uuid4()}.png"
-
-            # Convert PIL Image to bytes
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
+            if image.mode == "RGBA":
+                image = image.convert("RGB")
+
+            # Name the blob after the image content
+            filename = f"{digest}.png"
+
+            # Encode the PIL Image into this thread's reusable buffer, of which only the
+            # first length bytes are this image. The lowest compression level encodes
+            # several times faster for slightly larger files
+            img_byte_arr = _thread_buffer()
+            image.save(img_byte_arr, format="PNG", compress_level=1)
+            length = img_byte_arr.tell()
+            img_byte_arr.seek(0)
+
+            # Create a blob client and upload the image, the images themselves are
+            # uploaded concurrently so each is sent over one connection
+            blob_client = blob_service_client.get_blob_client(
+                container=container_name, blob=filename
+            )
+            try:
+                blob_client.upload_blob(
+                    img_byte_arr,
+                    length=length,
+                    blob_type="BlockBlob",
+                    overwrite=False,
+                    max_concurrency=1,
+                )
+            except ResourceExistsError:
+                # The same image was uploaded before
+                pass
+
+            return filename
+
+        # Only upload the first of identical images
+        digests = [_image_digest(image) for image in images]
+        unique_images = {}
+        for digest, image in zip(digests, images):
+            if digest is not None and digest not in unique_images:
+                unique_images[digest] = image
+
+        # Upload the images concurrently
+        with ThreadPoolExecutor(max_workers=MAX_CONNECTIONS) as executor:
+            filenames = dict(
+                zip(
+                    unique_images,
+                    executor.map(upload_one, unique_images, unique_images.values()),
+                )
+            )
 
-            # Create a blob client and upload the image
-            blob_client = blob_service_client.get_blob_client(container=container_name, blob=filename)
-            blob_client.upload_blob(img_byte_arr, blob_type="BlockBlob")
+        # Map every input image to its filename, keeping the input order
+        return [filenames.get(digest) for digest in digests]
 
-            uploaded_filenames.append(filename)
-            
-        return uploaded_filenames
-    
     @staticmethod
     def upload_image_to_azure(images, container_name, connection_string, path=None):
         """
@@ -323,12 +677,10 @@ class AzureStorage:
         :param path: Optional. Path to an image file.
         :return: Filename with UUID.
         """
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        blob_service_client = _get_blob_service_client(connection_string)
 
         # Create a container if it doesn't exist
-        container_client = blob_service_client.get_container_client(container_name)
-        if not container_client.exists():
-            container_client.create_container()
+        _get_container_client(connection_string, container_name)
 
         # Process images from the path if provided
         if path:
@@ -357,10 +709,10 @@ class AzureStorage:
         # Generate a unique filename using UUID
         filename = f"{uuid.uuid4()}.png"
 
-        # Convert PIL Image to bytes
+        # Encode the PIL Image into a buffer that is uploaded as is
         img_byte_arr = io.BytesIO()
         image.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
+        img_byte_arr.seek(0)
 
         # Create a blob client and upload the image
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=filename)
@@ -387,25 +739,51 @@ class AzureStorage:
             raise
 
     @staticmethod
-    def transfer_data_to_box(azure_connection_string, azure_container_name, box_folder_id, azure_folder_path=None, email_to_share = None):
+    def transfer_data_to_box(
+        azure_connection_string,
+        azure_container_name,
+        box_folder_id,
+        azure_folder_path=None,
+        email_to_share=None,
+        max_workers=MAX_CONNECTIONS,
+        delete_after_transfer=False,
+        max_buffered=32,
+    ):
         """
-        Transfer data from an Azure container to a Box folder. 
+        Transfer data from an Azure container to a Box folder.
         If a folder path is specified, upload that folder only; otherwise, upload the entire container.
 
         :param azure_connection_string: Connection string for Azure Blob Storage.
         :param azure_container_name: Name of the Azure container.
         :param box_folder_id: ID of the folder in Box where files will be uploaded.
         :param azure_folder_path: Path of the folder in Azure to upload (optional).
+        :param max_workers: Number of blobs downloaded from Azure concurrently. Box uploads stay sequential, as the Box client is not thread-safe.
+        :param delete_after_transfer: Delete the transferred blobs from Azure, in batches, once all of them are in Box.
+        :param max_buffered: Maximum number of downloaded blobs held in memory while waiting for their Box upload.
         """
+
         def sanitize_file_name(file_name):
             file_name = file_name.strip()
-            file_name = re.sub(r'[\/\\:*?"<>|]', '_', file_name)
+            file_name = file_name.translate(_BOX_NAME_TRANSLATION)
             max_length = 255
             if len(file_name) > max_length:
-                file_ext = file_name.split('.')[-1] if '.' in file_name else ''
-                file_name = file_name[:max_length - len(file_ext) - 1] + '.' + file_ext
+                file_ext = file_name.split(".")[-1] if "." in file_name else ""
+                file_name = file_name[: max_length - len(file_ext) - 1] + "." + file_ext
             return file_name
 
+        # Box folder ID -> {(item type, item name): item}, listed once per folder
+        folder_index = {}
+
+        def get_folder_index(box_client, folder_id):
+            if folder_id not in folder_index:
+                items = box_client.folder(folder_id).get_items(
+                    limit=1000, fields=["type", "id", "name"]
+                )
+                folder_index[folder_id] = {
+                    (item.type, item.name): item for item in items
+                }
+            return folder_index[folder_id]
+
         def create_folders(box_client, parent_id, folder_path):
             """
             Recursively create folders in Box according to the specified folder path.
@@ -415,27 +793,36 @@ class AzureStorage:
             :param folder_path: Path of the folder to create.
             :return: ID of the final child folder.
             """
-            if folder_path.startswith('/'):
+            if folder_path.startswith("/"):
                 folder_path = folder_path[1:]  # Remove leading slash if present
-            folder_names = folder_path.split('/')
+            folder_names = folder_path.split("/")
             current_folder_id = parent_id
             for folder_name in folder_names:
                 sanitized_folder_name = sanitize_file_name(folder_name)
                 try:
-                    items = box_client.folder(current_folder_id).get_items()
-                    folder = next((item for item in items if item.type == 'folder' and item.name == sanitized_folder_name), None)
+                    items = get_folder_index(box_client, current_folder_id)
+                    folder = items.get(("folder", sanitized_folder_name))
 
                     if folder is None:
-                        folder = box_client.folder(current_folder_id).create_subfolder(sanitized_folder_name)
-                        logger.info(f"Created folder '{sanitized_folder_name}' with ID: {folder.id}")
+                        folder = box_client.folder(current_folder_id).create_subfolder(
+                            sanitized_folder_name
+                        )
+                        items[("folder", sanitized_folder_name)] = folder
+                        logger.info(
+                            f"Created folder '{sanitized_folder_name}' with ID: {folder.id}"
+                        )
                     else:
-                        logger.info(f"Folder '{sanitized_folder_name}' found with ID: {folder.id}")
+                        logger.info(
+                            f"Folder '{sanitized_folder_name}' found with ID: {folder.id}"
+                        )
 
                     current_folder_id = folder.id
 
                 except BoxAPIException as e:
                     logger.error(f"Box API Exception: {e}")
-                    logger.error(f"Status: {e.status}, Code: {e.code}, Message: {e.message}")
+                    logger.error(
+                        f"Status: {e.status}, Code: {e.code}, Message: {e.message}"
+                    )
                     raise
                 except Exception as e:
                     logger.error(f"General Exception: {e}")
@@ -443,44 +830,162 @@ class AzureStorage:
             return current_folder_id
 
         # Initialize Azure Blob Service Client
-        blob_service_client = BlobServiceClient.from_connection_string(azure_connection_string)
-        container_client = blob_service_client.get_container_client(azure_container_name)
+        blob_service_client = _get_blob_service_client(azure_connection_string)
+        container_client = blob_service_client.get_container_client(
+            azure_container_name
+        )
 
         # Initialize Box Client
-        # Read the config file and parse it
-        with open('config.json', 'r') as config_file:
-            config = json.load(config_file)
-        auth = JWTAuth.from_settings_dictionary(config)
-        box_client = Client(auth)
+        box_client = _get_box_client()
         # List all blobs in Azure container or specific folder
-        blob_prefix = azure_folder_path if azure_folder_path else ''
-        blobs = container_client.list_blobs(name_starts_with=blob_prefix)
-
-        for blob in blobs:
-            if not blob.name.endswith('/'):  # Skip directories
+        blob_prefix = azure_folder_path if azure_folder_path else ""
+        blobs = container_client.list_blob_names(name_starts_with=blob_prefix)
+        blob_names = [
+            blob_name for blob_name in blobs if not blob_name.endswith("/")
+        ]  # Skip directories
+
+        def download(blob_name):
+            blob_client = blob_service_client.get_blob_client(
+                container=azure_container_name, blob=blob_name
+            )
+            stream = io.BytesIO()
+            blob_client.download_blob().readinto(stream)
+            stream.seek(0)
+            return stream
+
+        def transferred_streams(executor):
+            """Yields (blob name, content) in order, keeping at most max_buffered downloads ahead"""
+            pending = deque()
+            for blob_name in blob_names:
+                pending.append((blob_name, executor.submit(download, blob_name)))
+                if len(pending) >= max_buffered:
+                    blob_name, future = pending.popleft()
+                    yield blob_name, future.result()
+            while pending:
+                blob_name, future = pending.popleft()
+                yield blob_name, future.result()
+
+        # Download the blobs concurrently while uploading them to Box one at a time, in order.
+        # The bounded read-ahead keeps memory in check when Box is slower than Azure
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for blob_name, stream in transferred_streams(executor):
                 # Separate the file name and its directory path
-                dir_path, file_name = os.path.split(blob.name)
-                final_folder_id = create_folders(box_client, box_folder_id, dir_path) if dir_path else box_folder_id
+                dir_path, file_name = os.path.split(blob_name)
+                final_folder_id = (
+                    create_folders(box_client, box_folder_id, dir_path)
+                    if dir_path
+                    else box_folder_id
+                )
                 box_folder = box_client.folder(folder_id=final_folder_id)
 
-                # Download the blob
-                blob_client = blob_service_client.get_blob_client(container=azure_container_name, blob=blob.name)
-                stream = io.BytesIO(blob_client.download_blob().readall())
-
                 # Check if file exists in Box and update or upload accordingly
                 sanitized_name = sanitize_file_name(file_name)
-                items = box_folder.get_items()
-                existing_file = next((item for item in items if item.type == 'file' and item.name == sanitized_name), None)
+                items = get_folder_index(box_client, final_folder_id)
+                existing_file = items.get(("file", sanitized_name))
 
                 if existing_file:
                     # File exists, so update it
                     updated_file = existing_file.update_contents_with_stream(stream)
-                    logger.info(f"Updated {sanitized_name} in Box folder {final_folder_id}")
+                    logger.info(
+                        f"Updated {sanitized_name} in Box folder {final_folder_id}"
+                    )
                 else:
                     # File does not exist, so upload it
-                    box_folder.upload_stream(stream, sanitized_name)
-                    logger.info(f"Uploaded {sanitized_name} to Box folder {final_folder_id}")
+                    items[("file", sanitized_name)] = box_folder.upload_stream(
+                        stream, sanitized_name
+                    )
+                    logger.info(
+                        f"Uploaded {sanitized_name} to Box folder {final_folder_id}"
+                    )
                     # Add collaboration to the folder
                     if email_to_share is not None:
-                        AzureStorage.add_collaboration(box_client, final_folder_id, email_to_share, access_level='editor')  # Choose appropriate access level
-                
\ No newline at end of file
+                        AzureStorage.add_collaboration(
+                            box_client,
+                            final_folder_id,
+                            email_to_share,
+                            access_level="editor",
+                        )  # Choose appropriate access level
+
+        if delete_after_transfer:
+            _delete_blobs_in_batches(container_client, blob_names)
+            logger.info(
+                f"Deleted {len(blob_names)} transferred blobs from {azure_container_name}"
+            )
+
+
+class AsyncAzureStorage:
+    """
+    Async counterpart of AzureStorage for transfers that fan out to many blobs, which
+    are awaited together on one event loop instead of taking a thread each.
+    Use it as an async context manager so its connections are closed.
+    """
+
+    def __init__(self, connection_string, max_concurrency=MAX_ASYNC_TRANSFERS):
+        self.blob_service_client = AsyncBlobServiceClient.from_connection_string(
+            connection_string
+        )
+        self.max_concurrency = max_concurrency
+
+    async def __aenter__(self):
+        await self.blob_service_client.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.blob_service_client.close()
+
+    async def download_file(self, container_name, blob_name, download_folder):
+        blob_client = self.blob_service_client.get_blob_client(
+            container=container_name, blob=blob_name
+        )
+        download_file_path = os.path.join(download_folder, blob_name.replace("/", "_"))
+
+        downloader = await blob_client.download_blob()
+        # The file is written from worker threads, so large blobs do not stall the
+        # other coroutines of the event loop, e.g. the API calls of run_async
+        download_file = await asyncio.to_thread(open, download_file_path, "wb")
+        try:
+            async for chunk in downloader.chunks():
+                await asyncio.to_thread(download_file.write, chunk)
+        finally:
+            await asyncio.to_thread(download_file.close)
+        logger.info(f"Downloaded {container_name}/{blob_name} to {download_file_path}")
+
+    async def download_files(self, container_name, blob_names, download_folder):
+        """
+        Download blobs concurrently, at most max_concurrency at a time.
+
+        :param container_name: Name of the Azure storage container.
+        :param blob_names: The names of the blobs in the container.
+        :param download_folder: The local folder where the files should be downloaded.
+        """
+        os.makedirs(download_folder, exist_ok=True)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def download(blob_name):
+            async with semaphore:
+                await self.download_file(container_name, blob_name, download_folder)
+
+        await asyncio.gather(*(download(blob_name) for blob_name in blob_names))
+
+    async def fetch_files_from_folder(
+        self, container_name, folder_prefix, download_folder=None
+    ):
+        """
+        Fetch all files within a specific folder in a container.
+
+        :param container_name: Name of the Azure storage container.
+        :param folder_prefix: The folder path within the container from where files should be fetched.
+        :param download_folder: The local folder where the files should be downloaded (optional).
+        """
+        container_client = self.blob_service_client.get_container_client(container_name)
+        # This ensures we skip "folders" and only process "files"
+        blob_names = [
+            blob_name
+            async for blob_name in container_client.list_blob_names(
+                name_starts_with=folder_prefix
+            )
+            if not blob_name.endswith("/")
+        ]
+
+        if download_folder and blob_names:
+            await self.download_files(container_name, blob_names, download_folder)
@@ -1,40 +1,90 @@
 import os
+import threading
+import time
+from functools import lru_cache
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+# Refresh the cached token this many seconds before it actually expires
+TOKEN_EXPIRY_MARGIN = 60
+
+# Keeps the connection to the token endpoint alive between token requests, and
+# retries the request when the endpoint is throttling or briefly unavailable
+_session = requests.Session()
+_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(["POST"]),
+        ),
+    ),
+)
+
+# App settings holding the client credentials used to request access tokens
+TOKEN_SETTINGS = ("CLIENT_ID", "CLIENT_SECRET", "TENANT_ID", "SCOPE")
+
+_cached_token = None
+_token_expires_at = 0.0
+_token_lock = threading.Lock()
 
-def get_access_token() -> str:
-    client_id = os.getenv('CLIENT_ID')
-    client_secret = os.getenv('CLIENT_SECRET')
-    tenant_id = os.getenv('TENANT_ID')
-    scope = os.getenv('SCOPE')
 
-    # print(client_id)
-    # print(client_secret)
-    # print(tenant_id)
-    # print(scope)
+@lru_cache(maxsize=1)
+def _token_request():
+    """Reads and validates the credentials once, returning the token URL and body"""
+    missing = [name for name in TOKEN_SETTINGS if not os.getenv(name)]
+    if missing:
+        raise RuntimeError(
+            f"Missing settings for the access token: {', '.join(missing)}"
+        )
 
     # Token endpoint URL
+    tenant_id = os.getenv("TENANT_ID")
     token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
 
-    # Request headers
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-
     # Request body
     data = {
         "grant_type": "client_credentials",
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "scope": scope
+        "client_id": os.getenv("CLIENT_ID"),
+        "client_secret": os.getenv("CLIENT_SECRET"),
+        "scope": os.getenv("SCOPE"),
     }
+    return token_url, data
+
+
+def get_access_token() -> str:
+    """Returns the cached access token, fetching a new one when it is about to expire"""
+    global _cached_token, _token_expires_at
+    with _token_lock:
+        if _cached_token and time.time() < _token_expires_at - TOKEN_EXPIRY_MARGIN:
+            return _cached_token
+        _cached_token, expires_in = _fetch_access_token(*_token_request())
+        _token_expires_at = time.time() + expires_in
+        return _cached_token
+
+
+def _fetch_access_token(token_url, data):
+    # Request headers
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
     # Send POST request to get access token
-    response = requests.post(token_url, headers=headers, data=data)
+    response = _session.post(token_url, headers=headers, data=data)
 
     # Parse the JSON response
     token_response = response.json()
-    # print(token_response)
+    if "access_token" not in token_response:
+        raise RuntimeError(
+            f"Token request failed with status {response.status_code}: "
+            f"{token_response.get('error_description', response.text)}"
+        )
 
     # Extract the access token
     access_token = token_response["access_token"]
+    expires_in = float(token_response.get("expires_in", 0))
 
-    return access_token
+    return access_token, expires_in
@@ -1,269 +1,487 @@
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import numpy as np
-import json
 from pandas.api.types import CategoricalDtype
-from datetime import datetime
 import logging
 import hashlib
+import asyncio
+import threading
+import aiohttp
+import orjson
 
 logger = logging.getLogger(__name__)
 
-
-def generate_md5_as_number(row):
-    # Check if the columns exist in the DataFrame
-    media_type = (
-        str(row.get("Media Type", "")) if not pd.isna(row.get("Media Type")) else ""
+# Submission rows are posted concurrently, this many at a time
+MAX_CONCURRENT_SUBMISSIONS = 16
+# Submissions sent per request to the bulk endpoint, when create_submission uses it
+SUBMISSION_BATCH_SIZE = 1000
+# Statuses meaning the API has no bulk endpoint, so rows are posted one by one
+BULK_UNSUPPORTED_STATUSES = {404, 405}
+
+# A single event loop, kept running in a background thread, so the aiohttp session
+# and its keep-alive connections survive across requests and function invocations
+_loop = None
+_loop_lock = threading.Lock()
+_session = None
+# Submission URLs whose bulk endpoint was rejected, so it is not retried
+_bulk_unsupported_urls = set()
+
+# Keeps the connections to the API alive between the synchronous requests,
+# retrying idempotent ones on connection errors
+_http_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+)
+_http_session.mount("https://", _adapter)
+_http_session.mount("http://", _adapter)
+
+# Known project ids and vendor names per API base URL, filled on first use
+_projects_cache = {}
+_vendors_cache = {}
+
+
+def _json_headers(headers):
+    """Headers for a request whose body is already serialized to JSON bytes"""
+    return {**headers, "Content-Type": "application/json"}
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+    return _loop
+
+
+def run_async(coroutine):
+    """Runs a coroutine on the persistent event loop and returns its result"""
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_loop()).result()
+
+
+def _shared_session():
+    """Returns the aiohttp session shared by the API coroutines run with run_async"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+        )
+    return _session
+
+
+# Submission columns and the API fields they are sent as
+FIELD_MAPPING = {
+    "Vendor": "vendor",
+    "Market": "market",
+    "Zip": "state",
+    "Town ": "town",
+    "Media Type": "media_type",
+    "# of Units ": "total_units",
+    "TAB ID ": "geopath_id",
+    "Unit #": "unit",
+    "Location Description": "location_description",
+    "Facing": "facing",
+    "Size": "size",
+    "Availability": "availability_start",
+    "A18+ Weekly Impressions": "a18_weekly_impressions",
+    "A18+ Reach (%) ": "a18_4wk_reach",
+    "A18+ Freq (x)": "a18_4wk_freq",
+    "Illuminated?\n(Y or N)": "is_illuminated",
+    "1 Week Media Cost": "one_week_media_cost",
+    "2 Week Media Cost ": "two_week_media_cost",
+    "3 Week Media Cost ": "three_week_media_cost",
+    "4 Week Media Cost": "four_week_media_cost",
+    "Installation Cost ": "installation_cost",
+    "Production Cost": "production_cost",
+    "Is Production Forced ": "is_prod_forced",
+    "Target Location ": "target_location",
+    "Distance to Location ": "distance_to_location",
+    "Unit Highlights ": "unit_highlights",
+    "Latitude": "latitude",
+    "Longitude": "longitude",
+    " Spot Length\n(Seconds)": "spot_length_secs",
+    "# of Spots Per Loop ": "no_of_spots_per_loop",
+    "Images": "image_id",
+    "unit_id": "unit_id",
+}
+
+MAX_LENGTH = 255  # Maximum length for storing string values
+
+# Fields that get a generated identifier when they have no value. The unit gets one
+# too, the API identifies a submission without a unit number by it.
+GENERATED_ID_FIELDS = {"unit", "unit_id"}
+
+
+def _parse_dates(series):
+    """Parses m/d/yy dates into ISO strings, None where a value is not a valid date"""
+    dates = pd.to_datetime(
+        series.str.strip(), format="%m/%d/%y", errors="coerce", cache=True
     )
-    vendor = str(row.get("Vendor", "")) if not pd.isna(row.get("Vendor")) else ""
-    town = str(row.get("Town ", "")) if not pd.isna(row.get("Town ")) else ""
-    unit_number = str(row.get("Unit #", "")) if not pd.isna(row.get("Unit #")) else ""
-    weekly_impressions = (
-        str(row.get("A18+ Weekly Impressions", ""))
-        if not pd.isna(row.get("A18+ Weekly Impressions"))
-        else ""
+    return dates.dt.strftime("%Y-%m-%d").astype(object).where(dates.notna(), None)
+
+
+def parse_availability(series):
+    """
+    Splits availabilities like "01/31/24 - 03/31/24" into ISO start and end dates.
+    A single date only has a start, anything with more than one dash has neither.
+    """
+    dashes = series.str.count("-")
+    parts = (
+        series.str.split("-", n=1, expand=True).reindex(columns=[0, 1]).astype(object)
     )
+    availability_start = _parse_dates(parts[0].where(dashes <= 1))
+    availability_end = _parse_dates(parts[1].where(dashes == 1))
+    return availability_start, availability_end
 
-    data_string = f"{media_type}_{vendor}_{town}_{unit_number}_{weekly_impressions}"
-    return hashlib.md5(data_string.encode()).hexdigest()
 
+def _to_int(value):
+    return int(float(value))
 
-def is_valid_date(date_str):
-    try:
-        datetime.strptime(date_str, "%m/%d/%y").date()
-        return True
-    except ValueError:
-        return False
-
-
-def convert_row_to_payload(row):
-    payload = {}
-
-    field_mapping = {
-        "Vendor": "vendor",
-        "Market": "market",
-        "Zip": "state",
-        "Town ": "town",
-        "Media Type": "media_type",
-        "# of Units ": "total_units",
-        "TAB ID ": "geopath_id",
-        "Unit #": "unit",
-        "Location Description": "location_description",
-        "Facing": "facing",
-        'Size': 'size',
-        "Availability": "availability_start",
-        "A18+ Weekly Impressions": "a18_weekly_impressions",
-        "A18+ Reach (%) ": "a18_4wk_reach",
-        "A18+ Freq (x)": "a18_4wk_freq",
-        "Illuminated?\n(Y or N)": "is_illuminated",
-        "1 Week Media Cost": "one_week_media_cost",
-        "2 Week Media Cost ": "two_week_media_cost",
-        "3 Week Media Cost ": "three_week_media_cost",
-        "4 Week Media Cost": "four_week_media_cost",
-        "Installation Cost ": "installation_cost",
-        "Production Cost": "production_cost",
-        "Is Production Forced ": "is_prod_forced",
-        "Target Location ": "target_location",
-        "Distance to Location ": "distance_to_location",
-        "Unit Highlights ": "unit_highlights",
-        "Latitude": "latitude",
-        "Longitude": "longitude",
-        " Spot Length\n(Seconds)": "spot_length_secs",
-        "# of Spots Per Loop ": "no_of_spots_per_loop",
-        "Images":"image_id",
-        "unit_id":"unit_id",
-    }
 
-    MAX_LENGTH = 255  # Maximum length for storing string values
-
-    for df_column, schema_field in field_mapping.items():
-        if df_column in row:
-            value = row[df_column]
-
-            if pd.notna(value):
-                try:
-                    # Remove dollar signs and percentage signs
-                    value = str(value).replace("$", "").replace("%", "")
-
-                    # Handle special cases
-                    if "n/a - static" in value.lower():
-                        value = None
-                    elif schema_field in "location_description":
-                        # Truncate the location description if it exceeds the maximum length
-                        value = value[:MAX_LENGTH]
-                    else:
-                        # Explicitly cast the value to the expected type based on the schema
-                        if schema_field in "unit":
-                            # if pd.isna(value) or value.strip() == "":
-                            #     value = generate_md5_as_number(row)
-                            # else:
-                            value = str(value)
-                        elif (
-                            schema_field in "availability_start"
-                            or schema_field in "availability_end"
-                        ):
-                            dates = str(value).split("-")
-                            start_date, end_date = None, None
-
-                            if len(dates) == 2:
-                                if is_valid_date(dates[0].strip()):
-                                    start_date = (
-                                        datetime.strptime(dates[0].strip(), "%m/%d/%y")
-                                        .date()
-                                        .isoformat()
-                                    )
-                                if is_valid_date(dates[1].strip()):
-                                    end_date = (
-                                        datetime.strptime(dates[1].strip(), "%m/%d/%y")
-                                        .date()
-                                        .isoformat()
-                                    )
-
-                            elif len(dates) == 1 and is_valid_date(dates[0].strip()):
-                                start_date = (
-                                    datetime.strptime(dates[0].strip(), "%m/%d/%y")
-                                    .date()
-                                    .isoformat()
-                                )
-
-                            payload["availability_start"] = start_date
-                            payload["availability_end"] = end_date
-                            continue
-                        elif (
-                            schema_field in "a18_weekly_impressions"
-                            or schema_field in "total_units"
-                        ):
-                            try:
-                                value = int(float(value.replace(",", "")))
-                            except ValueError:
-                                logger.error(
-                                    f"Invalid integer value for column {df_column}: {value}"
-                                )
-                                value = None
-
-                        elif (
-                            schema_field in "a18_4wk_reach"
-                            or schema_field in "a18_4wk_freq"
-                            or schema_field in "installation_cost"
-                            or schema_field in "one_week_media_cost"
-                            or schema_field in "two_week_media_cost"
-                            or schema_field in "three_week_media_cost"
-                            or schema_field in "four_week_media_cost"
-                            or schema_field in "production_cost"
-                            or schema_field in "distance_to_location"
-                            or schema_field in "no_of_spots_per_loop"
-                            or schema_field in "spot_length_secs"
-                            or schema_field in "latitude"
-                            or schema_field in "longitude"
-                        ):
-                            value = float(value.replace(",", ""))
-                            if not (-1e308 < value < 1e308):  # Adjust range as needed
-                                value = None  # Replace invalid/out-of-range floats with None
-                        elif (
-                            schema_field in "is_illuminated"
-                            or schema_field in "is_prod_forced"
-                        ):
-                            value = True if value.lower() in "yes" else False
-                        elif schema_field in "image_id":
-                            value = str(value)
-                        else:
-                            value = str(value[:MAX_LENGTH])
-                except Exception as e:
-                    logger.error(f"Error converting value for column {df_column}: {e}")
-                    value = None
-
-                payload[schema_field] = value
-            else:
-                # If value is NaN or NaT, set it to None
-                payload[schema_field] = None
-                if schema_field in "unit_id":
-                    if pd.isna(value) or value.strip() == "":
-                        payload[schema_field] = generate_md5_as_number(row)
-        else:
-            payload[schema_field] = None
-            if df_column in "unit_id":
-                payload[schema_field] = generate_md5_as_number(row)
-    return payload
+def _to_float(value):
+    return float(value)
+
+
+def _to_bool(value):
+    return value.lower() in "yes"
+
+
+def _to_str(value):
+    return value
+
+
+def _to_truncated_str(value):
+    return value[:MAX_LENGTH]
 
 
-async def create_submission(df, headers, submission_url):
-    for _, row in df.iterrows():
-        submissions = convert_row_to_payload(row)
-        # Manually replace special float values before JSON serialization
-        json_data = json.dumps(submissions)
+# Dollar and percentage signs are removed from every value, and thousands
+# separators too from the numbers
+_SYMBOLS_TRANS = str.maketrans("", "", "$%")
+_NUMBER_SYMBOLS_TRANS = str.maketrans("", "", "$%,")
+# The lowercase values _to_bool takes as true, every substring of "yes"
+_TRUE_VALUES = {"yes"[start:end] for start in range(4) for end in range(start, 4)}
 
-        submission_response = requests.post(
-            submission_url, headers=headers, json=json.loads(json_data)
+# How the value of each API field is converted, fields not listed are truncated strings
+CONVERTERS = {
+    "a18_weekly_impressions": _to_int,
+    "total_units": _to_int,
+    "a18_4wk_reach": _to_float,
+    "a18_4wk_freq": _to_float,
+    "installation_cost": _to_float,
+    "one_week_media_cost": _to_float,
+    "two_week_media_cost": _to_float,
+    "three_week_media_cost": _to_float,
+    "four_week_media_cost": _to_float,
+    "production_cost": _to_float,
+    "distance_to_location": _to_float,
+    "no_of_spots_per_loop": _to_float,
+    "spot_length_secs": _to_float,
+    "latitude": _to_float,
+    "longitude": _to_float,
+    "is_illuminated": _to_bool,
+    "is_prod_forced": _to_bool,
+    "unit": _to_str,
+    "image_id": _to_str,
+}
+
+
+def _strip_symbols(values, schema_field):
+    """Removes the symbols from the string form of the values, in one pass per cell"""
+    converter = CONVERTERS.get(schema_field)
+    if converter in (_to_int, _to_float):
+        table = _NUMBER_SYMBOLS_TRANS
+    else:
+        table = _SYMBOLS_TRANS
+    return pd.Series(
+        [str(value).translate(table) for value in values],
+        index=values.index,
+        dtype=object,
+    )
+
+
+def _convert_value(converter, value, df_column):
+    try:
+        return converter(value)
+    except Exception as e:
+        logger.error(f"Error converting {value!r} for column {df_column}: {e}")
+        return None
+
+
+def _convert_floats(values, df_column):
+    """Parses a column of floats, with the range check done on the whole array"""
+    floats = np.array(
+        [_convert_value(_to_float, value, df_column) for value in values],
+        dtype=np.float64,
+    )
+    # Replace invalid/out-of-range floats with None
+    in_range = np.abs(floats) < 1e308
+    return pd.Series(floats, index=values.index).astype(object).where(in_range, None)
+
+
+def _convert_column(values, df_column, schema_field):
+    """Converts the cells of a column, already stripped by _strip_symbols"""
+    converter = CONVERTERS.get(schema_field, _to_truncated_str)
+    lowered = values.str.lower()
+    static = lowered.str.contains("n/a - static", regex=False)
+    values = values[~static]
+    if converter is _to_bool:
+        converted = lowered[~static].isin(_TRUE_VALUES)
+    elif converter is _to_float:
+        converted = _convert_floats(values, df_column)
+    else:
+        converted = pd.Series(
+            [_convert_value(converter, value, df_column) for value in values],
+            index=values.index,
+            dtype=object,
         )
+    return converted.astype(object).reindex(static.index)
+
+
+# Columns hashed into the generated id of a submission without a unit number
+UNIT_ID_COLUMNS = ["Media Type", "Vendor", "Town ", "Unit #", "A18+ Weekly Impressions"]
+
 
-        if submission_response.status_code == 201:
-            logger.info("Submission created successfully!")
-            logger.info("Response JSON:", submission_response.json())
+def compute_unit_ids(df):
+    """Hashes the identifying columns of every row into an MD5 hex digest"""
+    parts = []
+    for column in UNIT_ID_COLUMNS:
+        if column in df.columns:
+            values = df[column].astype(object)
+            parts.append(values.map(str).where(values.notna(), ""))
         else:
-            logger.error(
-                "Failed to create submission.\n Status Code: %d Response Text: %s",
-                submission_response.status_code,
-                submission_response.text,
+            parts.append(pd.Series("", index=df.index))
+    data_strings = parts[0].str.cat(parts[1:], sep="_")
+    return [
+        hashlib.md5(data.encode(), usedforsecurity=False).hexdigest()
+        for data in data_strings
+    ]
+
+
+def convert_df_to_payloads(df):
+    """Converts the submissions into one API payload per row, a column at a time"""
+    payload_columns = {}
+    generated_ids = None
+
+    for df_column, schema_field in FIELD_MAPPING.items():
+        if df_column not in df.columns:
+            values = pd.Series(None, index=df.index, dtype=object)
+            missing = pd.Series(df_column in GENERATED_ID_FIELDS, index=df.index)
+        else:
+            values = df[df_column].astype(object)
+            missing = values.isna()
+            # Remove dollar signs and percentage signs
+            present = _strip_symbols(values[~missing], schema_field)
+            values = pd.Series(None, index=df.index, dtype=object)
+            if schema_field == "availability_start":
+                static = present.str.lower().str.contains("n/a - static", regex=False)
+                availability_start, availability_end = parse_availability(
+                    present[~static]
+                )
+                payload_columns["availability_start"] = availability_start.reindex(
+                    df.index
+                )
+                payload_columns["availability_end"] = availability_end.reindex(df.index)
+                continue
+            values[present.index] = _convert_column(present, df_column, schema_field)
+            missing &= schema_field in GENERATED_ID_FIELDS
+
+        if missing.any():
+            if generated_ids is None:
+                generated_ids = pd.Series(compute_unit_ids(df), index=df.index)
+            values[missing] = generated_ids[missing]
+        payload_columns[schema_field] = values
+
+    payloads = pd.DataFrame(payload_columns, index=df.index).astype(object)
+    return payloads.where(payloads.notna(), None).to_dict("records")
+
+
+async def _post_submission(session, semaphore, payload, headers, submission_url):
+    async with semaphore:
+        async with session.post(
+            submission_url, headers=_json_headers(headers), data=orjson.dumps(payload)
+        ) as submission_response:
+            if submission_response.status == 201:
+                logger.info("Submission created successfully!")
+                logger.info(
+                    "Response JSON: %s",
+                    await submission_response.json(
+                        loads=orjson.loads, content_type=None
+                    ),
+                )
+            else:
+                logger.error(
+                    "Failed to create submission.\n Status Code: %d Response Text: %s",
+                    submission_response.status,
+                    await submission_response.text(),
+                )
+            return submission_response.status
+
+
+async def _post_submission_batch(session, semaphore, batch, headers, submission_url):
+    """
+    Posts a batch to the bulk endpoint. If the bulk request fails in any way, the
+    rows are posted one by one instead, so none of them is dropped.
+    """
+    if submission_url not in _bulk_unsupported_urls:
+        try:
+            async with semaphore:
+                async with session.post(
+                    f"{submission_url}/bulk",
+                    headers=_json_headers(headers),
+                    data=orjson.dumps(batch),
+                ) as submission_response:
+                    status = submission_response.status
+                    if status == 201:
+                        logger.info(f"Created {len(batch)} submissions")
+                        return [status] * len(batch)
+                    response_text = await submission_response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Bulk submission failed: {e}, posting rows one by one")
+        else:
+            if status in BULK_UNSUPPORTED_STATUSES:
+                logger.info(
+                    f"No bulk endpoint at {submission_url}, posting rows one by one"
+                )
+                _bulk_unsupported_urls.add(submission_url)
+            else:
+                logger.warning(
+                    "Bulk submission failed.\n Status Code: %d Response Text: %s"
+                    "\n Posting rows one by one",
+                    status,
+                    response_text,
+                )
+
+    return await asyncio.gather(
+        *(
+            _post_submission(session, semaphore, payload, headers, submission_url)
+            for payload in batch
+        )
+    )
+
+
+async def create_submission(
+    df,
+    headers,
+    submission_url,
+    session=None,
+    concurrency=MAX_CONCURRENT_SUBMISSIONS,
+    batch_size=SUBMISSION_BATCH_SIZE,
+    bulk=False,
+):
+    """
+    Posts the submissions with up to `concurrency` requests in flight. Returns the
+    response status of every row, in row order.
+    With `bulk`, rows are sent in batches of `batch_size` to the API's bulk endpoint,
+    falling back to one request per row for batches it does not accept.
+    """
+    session = session or _shared_session()
+    semaphore = asyncio.Semaphore(concurrency)
+    payloads = convert_df_to_payloads(df)
+    if not bulk:
+        return await asyncio.gather(
+            *(
+                _post_submission(session, semaphore, payload, headers, submission_url)
+                for payload in payloads
             )
+        )
+
+    batches = [
+        payloads[start : start + batch_size]
+        for start in range(0, len(payloads), batch_size)
+    ]
+    results = await asyncio.gather(
+        *(
+            _post_submission_batch(session, semaphore, batch, headers, submission_url)
+            for batch in batches
+        )
+    )
+    return [status for statuses in results for status in statuses]
 
 
 def fetch_projects(BASE_URL, header):
-    response = requests.get(f"{BASE_URL}/projects", headers=header)
+    response = _http_session.get(f"{BASE_URL}/projects", headers=header)
     if response.status_code == 200:
-        return response.json()["data"]
+        return orjson.loads(response.content)["data"]
     return []
 
 
 def create_project(BASE_URL, header, wilkins_id, name, client, status):
-    response = requests.post(
+    response = _http_session.post(
         f"{BASE_URL}/projects",
-        headers=header,
-        json={
-            "wilkins_id": wilkins_id,
-            "name": name,
-            "client": client,
-            "status": status,
-        },
+        headers=_json_headers(header),
+        data=orjson.dumps(
+            {
+                "wilkins_id": wilkins_id,
+                "name": name,
+                "client": client,
+                "status": status,
+            }
+        ),
     )
     logger.info(f"Base URL : {BASE_URL}, id: {wilkins_id}")
     if response.status_code == 201:
-        logger.info("Project created successfully:", response.json())
+        logger.info("Project created successfully: %s", orjson.loads(response.content))
+        return True
+    logger.error(f"Failed to create project: {response.status_code}, {response.text}")
+    return False
+
+
+def invalidate_cache(BASE_URL=None):
+    """Forgets the known projects and vendors, of one base URL or of all of them"""
+    if BASE_URL is None:
+        _projects_cache.clear()
+        _vendors_cache.clear()
     else:
-        logger.error(f"Failed to create project: {response.status_code}, {response.text}")
+        _projects_cache.pop(BASE_URL, None)
+        _vendors_cache.pop(BASE_URL, None)
 
 
 def check_and_create_project(BASE_URL, header, wilkins_id, name, client, status):
-    projects = fetch_projects(BASE_URL, header=header)
-    if not any(project["wilkins_id"] == wilkins_id for project in projects):
-        create_project(BASE_URL, header, wilkins_id, name, client, status)
+    if BASE_URL not in _projects_cache:
+        projects = fetch_projects(BASE_URL, header=header)
+        _projects_cache[BASE_URL] = {project["wilkins_id"] for project in projects}
+    if wilkins_id not in _projects_cache[BASE_URL]:
+        if create_project(BASE_URL, header, wilkins_id, name, client, status):
+            _projects_cache[BASE_URL].add(wilkins_id)
     else:
         logger.info("Project already exists")
 
 
 def fetch_vendors(BASE_URL, header):
     # Assuming this endpoint returns all vendors
-    response = requests.get(BASE_URL + "/vendors", headers=header)
+    response = _http_session.get(BASE_URL + "/vendors", headers=header)
     if response.status_code == 200:
-        return response.json()
+        return orjson.loads(response.content)
     return []
 
 
 def create_vendor(BASE_URL, header, wilkins_id, vendor_name):
-    response = requests.post(
+    response = _http_session.post(
         BASE_URL + f"/projects/{wilkins_id}/vendors",
-        headers=header,
-        json={"name": vendor_name},
+        headers=_json_headers(header),
+        data=orjson.dumps({"name": vendor_name}),
     )
     if response.status_code == 201:
-        logger.info("Vendor created successfully:", response.json())
-    else:
-        logger.error(f"Failed to create vendor: {response.status_code}, {response.text}")
+        logger.info("Vendor created successfully: %s", orjson.loads(response.content))
+        return True
+    logger.error(f"Failed to create vendor: {response.status_code}, {response.text}")
+    return False
 
 
 def check_and_create_vendor(BASE_URL, header, wilkins_id, vendor_name):
-    vendors = fetch_vendors(BASE_URL, header)
-    if not any(vendor == vendor_name for vendor in vendors):
-        create_vendor(BASE_URL, header, wilkins_id, vendor_name)
+    if BASE_URL not in _vendors_cache:
+        vendors = fetch_vendors(BASE_URL, header)
+        # Only names can match, so anything unhashable is left out
+        _vendors_cache[BASE_URL] = {
+            vendor for vendor in vendors if isinstance(vendor, str)
+        }
+    if vendor_name not in _vendors_cache[BASE_URL]:
+        if create_vendor(BASE_URL, header, wilkins_id, vendor_name):
+            _vendors_cache[BASE_URL].add(vendor_name)
     else:
         logger.info("Vendor already exists")
 
@@ -280,6 +498,7 @@ async def fetch_submissions(
     selected=None,
     limit=0,
     skip=0,
+    session=None,
 ):
     params = {
         "state": state,
@@ -292,16 +511,23 @@ async def fetch_submissions(
         # "skip": skip,
     }
 
-    # Remove None values from params
-    params = {k: v for k, v in params.items() if v is not None}
+    # Remove None values from params, aiohttp only accepts str, int and float values
+    params = {
+        k: str(v) if isinstance(v, bool) else v
+        for k, v in params.items()
+        if v is not None
+    }
 
-    response = requests.get(
+    session = session or _shared_session()
+    async with session.get(
         f"{BASE_URL}/projects/{wilkins_id}/submissions", headers=header, params=params
-    )
-    if response.status_code == 200:
-        return response.json()
-    else:
-        logger.error(
-            "Failed to fetch submissions:", response.status_code, response.text
-        )
-        return None
+    ) as response:
+        if response.status == 200:
+            return await response.json(loads=orjson.loads, content_type=None)
+        else:
+            logger.error(
+                "Failed to fetch submissions: %s %s",
+                response.status,
+                await response.text(),
+            )
+            return None
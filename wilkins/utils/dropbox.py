@@ -1,13 +1,29 @@
 import os
+import shutil
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from zipfile import ZipFile
-from io import BytesIO
+from tempfile import SpooledTemporaryFile
 import logging
-import http.client
-from urllib.parse import urlparse, unquote, urljoin, parse_qs
+from urllib.parse import unquote, parse_qs
 
 logger = logging.getLogger(__name__)
 
+# Shared by the downloads so connections to the file hosts are reused
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+# Downloads are kept in memory up to this size, and spill to a temporary file beyond
+DOWNLOAD_SPOOL_SIZE = 16 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 def is_zip_file_signature(data):
     return (
@@ -17,93 +33,104 @@ def is_zip_file_signature(data):
     )
 
 
-def download_and_extract_zip_azure(url, extract_to, azure_storage, container_name):
-    if not os.path.exists(extract_to):
-        os.makedirs(extract_to)
+def _stream_to_file(response, file):
+    """Writes the body of a streamed response to a file, then rewinds the file"""
+    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+        file.write(chunk)
+    file.seek(0)
+
 
-    final_url = handle_protected_url(url)
+def _is_zip_stream(file):
+    """Checks the signature at the start of a file, leaving it at the start"""
+    signature = file.read(4)
+    file.seek(0)
+    return is_zip_file_signature(signature)
+
+
+def download_and_extract_zip_azure(url, azure_storage, container_name):
+    """
+    Uploads the files of a downloaded ZIP, or the downloaded file itself, to a
+    container, streaming them without writing anything to disk.
+    """
+    # Rewrite Dropbox links first, which saves the hop to their preview page
+    final_url = handle_protected_url(get_final_dropbox_url(url))
     url = get_final_dropbox_url(final_url)
-    response = requests.get(url)
-    if response.status_code == 200:
-        if is_zip_file_signature(response.content):
-            with ZipFile(BytesIO(response.content)) as zip_file:
-                zip_file.extractall(extract_to)
-            logger.info(f"ZIP file extracted to {extract_to}")
-        else:
-            # Decode and remove URL parameters
-            file_name = unquote(url.split("/")[-1].split("?")[0])
-            file_path = os.path.join(extract_to, file_name)
-            with open(file_path, "wb") as file:
-                file.write(response.content)
-            logger.info(f"Non-ZIP file saved to {extract_to}")
-
-        # Upload to Azure and clean up
-        for filename in os.listdir(extract_to):
-            file_path = os.path.join(extract_to, filename)
-            azure_storage.upload_file(container_name, file_path)
-            logger.info(
-                f"Uploaded {filename} to Azure Blob Storage in container {container_name}"
-            )
-            os.remove(file_path)
-
-        os.rmdir(extract_to)
-        logger.info("Cleaned up extracted files")
-    else:
-        logger.error(f"Failed to download. Status code: {response.status_code}")
+    with _session.get(url, stream=True) as response:
+        if response.status_code != 200:
+            logger.error(f"Failed to download. Status code: {response.status_code}")
+            return
+
+        with SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE) as body:
+            _stream_to_file(response, body)
+            if not _is_zip_stream(body):
+                # Decode and remove URL parameters
+                file_name = unquote(url.split("/")[-1].split("?")[0])
+                azure_storage.get_blob_client(container_name, file_name).upload_blob(
+                    body, overwrite=True
+                )
+                logger.info(f"Uploaded {file_name} to container {container_name}")
+                return
+
+            with ZipFile(body) as zip_file:
+                for member in zip_file.infolist():
+                    if member.is_dir():
+                        continue
+                    blob_client = azure_storage.get_blob_client(
+                        container_name, member.filename
+                    )
+                    with zip_file.open(member) as data:
+                        blob_client.upload_blob(
+                            data, length=member.file_size, overwrite=True
+                        )
+                    logger.info(
+                        f"Uploaded {member.filename} to container {container_name}"
+                    )
 
 
 def download_and_extract_zip(url, extract_to):
     if not os.path.exists(extract_to):
         os.makedirs(extract_to)
 
-    final_url = handle_protected_url(url)
+    # Rewrite Dropbox links first, which saves the hop to their preview page
+    final_url = handle_protected_url(get_final_dropbox_url(url))
     url = get_final_dropbox_url(final_url)
-    response = requests.get(url)
-    if response.status_code == 200:
-        if is_zip_file_signature(response.content):
-            with ZipFile(BytesIO(response.content)) as zip_file:
-                zip_file.extractall(extract_to)
-            logger.info(f"ZIP file extracted to {extract_to}")
-        else:
-            # Decode and remove URL parameters
-            file_name = unquote(url.split("/")[-1].split("?")[0])
-            file_path = os.path.join(extract_to, file_name)
-            with open(file_path, "wb") as file:
-                file.write(response.content)
-            logger.info(f"Non-ZIP file saved to {extract_to}")
-    else:
-        logger.error(f"Failed to download. Status code: {response.status_code}")
+    with _session.get(url, stream=True) as response:
+        if response.status_code != 200:
+            logger.error(f"Failed to download. Status code: {response.status_code}")
+            return
+
+        with SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE) as body:
+            _stream_to_file(response, body)
+            if _is_zip_stream(body):
+                with ZipFile(body) as zip_file:
+                    zip_file.extractall(extract_to)
+                logger.info(f"ZIP file extracted to {extract_to}")
+            else:
+                # Decode and remove URL parameters
+                file_name = unquote(url.split("/")[-1].split("?")[0])
+                file_path = os.path.join(extract_to, file_name)
+                with open(file_path, "wb") as file:
+                    shutil.copyfileobj(body, file)
+                logger.info(f"Non-ZIP file saved to {extract_to}")
 
 
 def handle_protected_url(url):
     """Follow redirects and return the final URL."""
-    parsed_url = urlparse(url)
-    connection = (
-        http.client.HTTPSConnection(parsed_url.netloc)
-        if parsed_url.scheme == "https"
-        else http.client.HTTPConnection(parsed_url.netloc)
-    )
-
     try:
-        connection.request("GET", parsed_url.path + "?" + parsed_url.query)
-        response = connection.getresponse()
-
-        if response.status in [301, 302, 303, 307]:
-            location = response.getheader("Location")
-            # Handle relative URLs for redirection
-            new_url = urljoin(url, location)
-            # Recursively follow the redirect
-            return handle_protected_url(new_url)
-        elif response.status == 200:
-            return url  # No further redirection, return the original URL
-        else:
-            logger.error(f"Error following redirect: HTTP status {response.status}")
-            raise Exception(f"Error following redirect: HTTP status {response.status}")
+        response = _session.head(url, allow_redirects=True, timeout=10)
+        if response.status_code != 200:
+            # Some servers do not answer HEAD, or only sign the URL for GET (e.g. S3
+            # presigned URLs answer HEAD with 403), so follow with a GET left unread
+            response = _session.get(url, allow_redirects=True, stream=True, timeout=10)
+            response.close()
+
+        if response.status_code == 200:
+            return response.url
+        logger.error(f"Error following redirect: HTTP status {response.status_code}")
+        raise Exception(f"Error following redirect: HTTP status {response.status_code}")
     except Exception as e:
         logger.error(f"Error processing URL {url}: {e}")
         raise Exception(f"Error processing URL {url}: {e}")
-    finally:
-        connection.close()
 
 
 def get_final_dropbox_url(url):
@@ -1,42 +1,168 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 from PIL import Image
 import io
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# Shared by the page and image requests so connections to each site are reused
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+# Pages and images downloaded earlier are kept, and revalidated with a conditional GET
+HTTP_CACHE_SIZE = 128
+# Larger responses are not kept
+HTTP_CACHE_MAX_BODY = 4 * 1024 * 1024
+_http_cache = OrderedDict()
+_http_cache_lock = threading.Lock()
+
+# Images of a page are downloaded in parallel, this many at a time
+MAX_IMAGE_DOWNLOADS = 32
+# Images loaded earlier are reused, failures are not kept so they are retried
+IMAGE_CACHE_SIZE = 256
+_image_cache = OrderedDict()
+_image_cache_lock = threading.Lock()
+# Query parameters that only track the visit, so URLs differing in them match
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+
+# Leading bytes of the image formats kept as downloaded, without re-encoding them
+IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a")
+
+
+def has_image_signature(data):
+    """Checks whether the bytes start like a JPEG, PNG, GIF or WebP image"""
+    return data.startswith(IMAGE_SIGNATURES) or (
+        data[:4] == b"RIFF" and data[8:12] == b"WEBP"
+    )
+
+
+def cached_get(url, **kwargs):
+    """
+    GET through the shared session, answered from the cache when the server says
+    the earlier response is still current, or when the request fails.
+    """
+    with _http_cache_lock:
+        cached = _http_cache.get(url)
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if cached is not None:
+        if "ETag" in cached.headers:
+            headers["If-None-Match"] = cached.headers["ETag"]
+        if "Last-Modified" in cached.headers:
+            headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+    try:
+        response = _session.get(url, headers=headers, **kwargs)
+    except requests.RequestException as e:
+        if cached is None:
+            raise
+        logger.warning(f"Using the cached response of {url}: {e}")
+        return cached
+
+    if response.status_code == 304 and cached is not None:
+        response.close()
+        with _http_cache_lock:
+            _http_cache.move_to_end(url)
+        return cached
+
+    if (
+        response.status_code == 200
+        and ("ETag" in response.headers or "Last-Modified" in response.headers)
+        and len(response.content) <= HTTP_CACHE_MAX_BODY
+    ):
+        with _http_cache_lock:
+            _http_cache[url] = response
+            _http_cache.move_to_end(url)
+            while len(_http_cache) > HTTP_CACHE_SIZE:
+                _http_cache.popitem(last=False)
+    return response
+
+
+def load_image_from_url(url):
+    """Downloads an image and returns its bytes, None if the URL is not an image"""
+    try:
+        with cached_get(url, timeout=10) as response:
+            content_type = response.headers.get("Content-Type", "")
+
+            # Check if the content type is of an image
+            if response.status_code == 200 and "image" in content_type:
+                if has_image_signature(response.content):
+                    return response.content
+
+                # Re-encode anything else, which also checks that it is an image
+                image = Image.open(io.BytesIO(response.content))
+                img_byte_arr = io.BytesIO()
+                image_format = image.format or "PNG"
+                image.save(img_byte_arr, format=image_format)
+                img_byte_arr.seek(0)  # Go to the start of the stream
+                return img_byte_arr.getvalue()
+            else:
+                logger.warning(
+                    f"URL did not point to an image or response was not successful. URL: {url}, Content-Type: {content_type}"
+                )
+                return None
+
+    except Exception as e:
+        logger.error(f"Error loading image from {url}: {e}")
+        return None
+
+
+def normalize_image_url(url):
+    """Drops the tracking query parameters of a URL, and leaves the rest as it is"""
+    parsed = urlparse(url)
+    query = parse_qsl(parsed.query, keep_blank_values=True)
+    kept = [(key, value) for key, value in query if not key.startswith(TRACKING_PARAMS)]
+    if len(kept) == len(query):
+        return url
+    return urlunparse(parsed._replace(query=urlencode(kept)))
+
+
+def load_image_cached(url):
+    """load_image_from_url, reusing the image already loaded from the same URL"""
+    url = normalize_image_url(url)
+    with _image_cache_lock:
+        image = _image_cache.get(url)
+        if image is not None:
+            _image_cache.move_to_end(url)
+            return image
+
+    image = load_image_from_url(url)
+    if image is not None:
+        with _image_cache_lock:
+            _image_cache[url] = image
+            while len(_image_cache) > IMAGE_CACHE_SIZE:
+                _image_cache.popitem(last=False)
+    return image
+
+
+def load_images_from_urls(url_lists, max_workers=MAX_IMAGE_DOWNLOADS):
+    """Downloads the images of every group in parallel, keeping the groups' order"""
+    urls = [normalize_image_url(url) for group in url_lists for url in group]
+    # Download each distinct image once, however many rows show it
+    unique_urls = list(dict.fromkeys(urls))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        loaded = dict(zip(unique_urls, executor.map(load_image_cached, unique_urls)))
+    images = iter([loaded[url] for url in urls])
 
-def load_images_from_urls(url_lists):
     images_bytes_groups = []
-    for urls in url_lists:
-        images_bytes = []
-        if len(urls) == 0:
-            images_bytes.append(None)
-        for url in urls:
-            try:
-                with requests.get(url, timeout=10) as response:
-                    content_type = response.headers.get("Content-Type", "")
-
-                    # Check if the content type is of an image
-                    if response.status_code == 200 and "image" in content_type:
-                        image = Image.open(io.BytesIO(response.content))
-                        img_byte_arr = io.BytesIO()
-                        image_format = image.format or "PNG"
-                        image.save(img_byte_arr, format=image_format)
-                        img_byte_arr.seek(0)  # Go to the start of the stream
-                        images_bytes.append(img_byte_arr.getvalue())
-                    else:
-                        logger.warning(
-                            f"URL did not point to an image or response was not successful. URL: {url}, Content-Type: {content_type}"
-                        )
-                        images_bytes.append(None)
-
-            except Exception as e:
-                logger.error(f"Error loading image from {url}: {e}")
-                images_bytes.append(None)
-        images_bytes_groups.append(images_bytes)
+    for group in url_lists:
+        if len(group) == 0:
+            images_bytes_groups.append([None])
+        else:
+            images_bytes_groups.append([next(images) for _ in group])
     return images_bytes_groups
 
 
@@ -47,13 +173,13 @@ def fetch_page_content(url):
         # url = 'https://' + url
         return None
     # Fetch the initial page content
-    response = requests.get(url)
+    response = cached_get(url)
     if response.status_code != 200:
         logger.error(f"Failed to load page: {url}")
         raise Exception(f"Failed to load page: {url}")
 
     # Parse the HTML content
-    soup = BeautifulSoup(response.content, "html.parser")
+    soup = BeautifulSoup(response.content, "lxml")
 
     # Look for a <frame> tag
     frame = soup.find("frame")
@@ -66,7 +192,7 @@ def fetch_page_content(url):
             frame_url = base_url + "/" + frame_url
 
         # Fetch the content of the frame
-        frame_response = requests.get(frame_url)
+        frame_response = cached_get(frame_url)
         if frame_response.status_code != 200:
             logger.error(f"Failed to load frame content: {frame_url}")
             raise Exception(f"Failed to load frame content: {frame_url}")
@@ -81,7 +207,7 @@ def get_specific_base_url(url):
     if "linkprotect.cudasvc.com" in url:
         try:
             # Follow the redirect to get the actual URL
-            response = requests.get(url, timeout=10, allow_redirects=True)
+            response = _session.get(url, timeout=10, allow_redirects=True)
             response.raise_for_status()
             url = response.url  # Update the URL to the redirected one
         except Exception as e:
@@ -98,21 +224,17 @@ def get_specific_base_url(url):
     return base_url
 
 
-def table_search_criteria(tag):
-    return (
-        tag.name == "table"
-        and tag.get("border") == "0"
-        and tag.get("cellpadding") == "1"
-        and tag.get("cellspacing") == "1"
-        and tag.get("width") == "300"
-    )
+# The ePitch tables holding a unit's details and images
+EPITCH_TABLE_SELECTOR = (
+    'table[border="0"][cellpadding="1"][cellspacing="1"][width="300"]'
+)
 
 
 def extract_tables_content(html_content, base_url):
-    soup = BeautifulSoup(html_content, "html.parser")
+    soup = BeautifulSoup(html_content, "lxml")
 
     # Find all tables with the specified attributes
-    tables = soup.find_all(table_search_criteria)
+    tables = soup.select(EPITCH_TABLE_SELECTOR)
 
     all_tables_text = []
     all_tables_images = []
@@ -161,7 +283,7 @@ def extract_epitch_content_and_images(url):
 
 
 def extract_barrett_html(html_content, base_url):
-    soup = BeautifulSoup(html_content, "html.parser")
+    soup = BeautifulSoup(html_content, "lxml")
 
     # Extract all text
     all_text = soup.get_text(separator="\n", strip=True)
@@ -170,7 +292,7 @@ def extract_barrett_html(html_content, base_url):
     )  # Removing excessive newlines
 
     # Find the specific image
-    image = soup.find("img", {"id": "billboard-image"})
+    image = soup.select_one("img#billboard-image")
 
     # Extract and adjust the image URL
     image_urls = []  # Initialize as an empty list
@@ -1,11 +1,12 @@
 import pandas as pd
+import numpy as np
 import os
 import re
 import zipfile
 import openpyxl
 from io import BytesIO
-import base64
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ExifTags
 import hashlib
 import logging
@@ -24,7 +25,10 @@ def zip_file(file_path, zip_path):
     """
     Zip a file at the given path.
     """
-    with zipfile.ZipFile(zip_path, "w") as zipf:
+    with zipfile.ZipFile(
+        zip_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1
+    ) as zipf:
+        # Streams the file into the archive in blocks, at the archive's level
         zipf.write(file_path, os.path.basename(file_path))
 
 
@@ -32,46 +36,40 @@ def detect_sheet_and_header(file_path, probe_rows=5):
     """
     Detect the correct sheet and header row based on the given heuristic.
     """
-    # Load the Excel file without any data to access the sheet names
-    xls = pd.ExcelFile(file_path)
-
-    if len(xls.sheet_names) == 1:
-        rfp_sheets = [xls.sheet_names[0]]
-    else:
-        rfp_sheets = [sheet for sheet in xls.sheet_names]
+    # Stream only the first rows of each sheet, without loading the whole workbook
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    header_values = {"Market", "Vendor", "Size"}
 
     target_sheest = []
     target_header_rows = []
 
-    for sheet in rfp_sheets:
-        df_probe = pd.read_excel(
-            file_path, sheet_name=sheet, nrows=probe_rows, header=None
-        )
-
-        # Checking each row for the presence of the specified values
-        for idx, row in df_probe.iterrows():
-            if any(val in row.values for val in ["Market", "Vendor", "Size"]):
-                target_sheest.append(sheet)
-                target_header_rows.append(idx)
-                break
+    try:
+        for sheet in wb.sheetnames:
+            rows = wb[sheet].iter_rows(min_row=1, max_row=probe_rows, values_only=True)
+
+            # Checking each row for the presence of the specified values
+            for idx, row in enumerate(rows):
+                if not header_values.isdisjoint(row):
+                    target_sheest.append(sheet)
+                    target_header_rows.append(idx)
+                    break
+    finally:
+        wb.close()
 
     return target_sheest, target_header_rows
 
 
 def extract_images_to_df(file_path):
-    """Extract the images from the .xlsx file and returns those images as bytes"""
-    images_data = []
-
+    """Extract the images from the .xlsx file and yields those images as bytes"""
     # Open the .xlsx file as a zip file
     with zipfile.ZipFile(file_path, "r") as zip_ref:
         # Iterate through each file in the zip
-        for file in zip_ref.namelist():
+        for member in zip_ref.infolist():
             # Adjusted to handle different image storage
-            if file.startswith("xl/media/"):
-                img_data = zip_ref.read(file)
-                images_data.append(img_data)
-
-    return images_data
+            if member.filename.startswith("xl/media/"):
+                # Read one image at a time, only while the caller is using it
+                with zip_ref.open(member) as img_file:
+                    yield img_file.read()
 
 
 def correct_image_orientation(img):
@@ -93,26 +91,74 @@ def correct_image_orientation(img):
     return img
 
 
+# Key of the PIL image info holding the file a JPEG image was decoded from
+JPEG_BYTES_KEY = "jpeg_bytes"
+
+
+def _load_oriented_image(image):
+    img = Image.open(image.ref)
+    img.load()  # Decode now, in the worker thread, rather than lazily on first use
+    if img.format == "JPEG":
+        # Keep the original file, to store it again as is instead of re-encoding it
+        img.info[JPEG_BYTES_KEY] = image.ref.getvalue()
+    return correct_image_orientation(img)  # Correct orientation
+
+
+def image_to_jpeg_bytes(image):
+    """Encodes an image as JPEG, reusing its original file if it was an upright JPEG"""
+    # Rotated or converted images lose their format, so their file is not reused
+    if image.format == "JPEG" and image.mode in ("RGB", "L"):
+        jpeg_bytes = image.info.get(JPEG_BYTES_KEY)
+        if jpeg_bytes is not None:
+            return jpeg_bytes
+
+    # Convert the image to RGB mode if it's in RGBA mode
+    if image.mode == "RGBA":
+        image = image.convert("RGB")
+
+    image_stream = BytesIO()
+    image.save(image_stream, format="JPEG")
+    return image_stream.getvalue()
+
+
 def extract_all_images(sheet):
     """Extract all images from the sheet"""
-    images = []
-    for image in sheet._images:
-        img = Image.open(image.ref)
-        img = correct_image_orientation(img)  # Correct orientation
-        images.append(img)
-    return images
-
-
-def has_required_headers(sheet, required_headers):
-    """Check if the sheet has the required headers"""
-    for row in sheet.iter_rows(values_only=True):
-        if all(header in row for header in required_headers):
+    # Identify the images by their raw file, so a picture placed several times is
+    # only decoded once and all its copies share the same PIL image
+    digests = [
+        hashlib.blake2b(image.ref.getvalue(), digest_size=16).digest()
+        for image in sheet._images
+    ]
+    unique_images = dict(zip(digests, sheet._images))
+
+    # PIL decodes and rotates without holding the GIL, so the images load in parallel
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        loaded_images = executor.map(_load_oriented_image, unique_images.values())
+        images_by_digest = dict(zip(unique_images, loaded_images))
+    return [images_by_digest[digest] for digest in digests]
+
+
+def has_required_headers(sheet, required_headers, probe_rows=10):
+    """Check if the sheet has the required headers, in one of its first rows"""
+    required_headers = set(required_headers)
+    for row in sheet.iter_rows(max_row=probe_rows, values_only=True):
+        if required_headers.issubset(row):
             return True
     return False
 
 
+def has_embedded_media(file_path):
+    """Checks the .xlsx archive for media files, without parsing the workbook"""
+    with zipfile.ZipFile(file_path, "r") as zip_ref:
+        return any(name.startswith("xl/media/") for name in zip_ref.namelist())
+
+
 def extract_images_to_dict(file_path):
-    wb = openpyxl.load_workbook(file_path, data_only=True)
+    # Images are only loaded by a full (not read-only) load, skip it if there are none
+    if not has_embedded_media(file_path):
+        return {}
+
+    wb = openpyxl.load_workbook(file_path, data_only=True, keep_links=False)
     images_dict = defaultdict(list)
 
     if "Photos" in wb.sheetnames:
@@ -157,29 +203,40 @@ def extract_images_to_dict(file_path):
     return dict(images_dict)
 
 
-def image_to_base64(image):
-    # Convert the image to its base64-encoded representation
-    image_stream = BytesIO()
-    image_rgb = image.convert("RGB")  # Convert to RGB mode
-    image_rgb.save(image_stream, format="JPEG")
-    image_stream.seek(0)
-    return base64.b64encode(image_stream.read()).decode("utf-8")
+def image_dhash(image, hash_size=8):
+    """
+    Perceptual difference hash of an image as a 64-bit int: each bit tells whether a
+    pixel of the shrunk grayscale image is brighter than its right neighbour.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
 
 
 def remove_duplicates_from_all_images(all_images):
     # Create a new dictionary to store unique images for each label
     unique_images_dict = {}
+    # Copies of the same embedded file share one PIL image, fingerprint each only once
+    distinct_images = {
+        id(image): image for images in all_images.values() for image in images
+    }
+    # Fingerprint the images instead of encoding the whole of them, all at once in
+    # parallel since PIL resizes without holding the GIL
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        image_hashes = dict(
+            zip(distinct_images, executor.map(image_dhash, distinct_images.values()))
+        )
+
     for label, images in all_images.items():
         unique_images = []
         seen_images = set()
 
         for image in images:
-            # Convert the image to base64-encoded representation
-            image_data = image_to_base64(image)
-
-            if image_data not in seen_images:
+            image_hash = image_hashes[id(image)]
+            if image_hash not in seen_images:
                 unique_images.append(image)
-                seen_images.add(image_data)
+                seen_images.add(image_hash)
 
         unique_images_dict[label] = unique_images
 
@@ -192,8 +249,10 @@ def append_images_to_df(file_path, target_sheets, target_header_rows, all_images
     # Remove duplicates from the all_images dictionary
     unique_images_dict = remove_duplicates_from_all_images(all_images)
 
+    # Open the workbook once for all the target sheets
+    xls = pd.ExcelFile(file_path)
     for sheet_name, header_row in zip(target_sheets, target_header_rows):
-        data_df = pd.read_excel(file_path, sheet_name=sheet_name, header=header_row)
+        data_df = xls.parse(sheet_name=sheet_name, header=header_row)
         data_df = data_df.dropna(subset=["Market", "Vendor", "Size"])
         data_df["Images"] = None
 
@@ -202,18 +261,36 @@ def append_images_to_df(file_path, target_sheets, target_header_rows, all_images
             key: images.copy() for key, images in unique_images_dict.items()
         }
 
-        for idx, row in data_df.iterrows():
+        # Lowercase the cells once, instead of converting every row to match it
+        lowercase_cells = data_df.astype(object).astype(str)
+        for column in lowercase_cells.columns:
+            lowercase_cells[column] = lowercase_cells[column].str.lower()
+        keys = list(available_images)
+        lowercase_keys = [key.lower() for key in keys]
+        # Match each distinct cell against the labels once, rather than once per row:
+        # cell -> positions of the labels it matches
+        labels_by_cell = {}
+        for cell in pd.unique(lowercase_cells.to_numpy().ravel()):
+            matched = {
+                position
+                for position, key in enumerate(lowercase_keys)
+                if key in cell or cell in key
+            }
+            if matched:
+                labels_by_cell[cell] = matched
+        images_column = []
+
+        for cells in lowercase_cells.itertuples(index=False, name=None):
             assigned_image = None
 
-            for key in available_images.keys():
-                if any(
-                    key in cell.lower() or cell.lower() in key
-                    for key in available_images.keys()
-                    for cell in row.astype(str).str.lower()
-                ):
-                    if available_images[key]:
-                        assigned_image = available_images[key].pop()
-                        break  # Stop searching once an image is assigned
+            # The row takes the next image of the first label it matches that has any
+            row_labels = set()
+            for cell in cells:
+                row_labels.update(labels_by_cell.get(cell, ()))
+            for position in sorted(row_labels):
+                if available_images[keys[position]]:
+                    assigned_image = available_images[keys[position]].pop()
+                    break
 
             if assigned_image is None:
                 # If no images found in associated columns, use an image from "unlabeled" (if available)
@@ -222,23 +299,16 @@ def append_images_to_df(file_path, target_sheets, target_header_rows, all_images
                 else:
                     assigned_image = None
 
-            # Convert the assigned image to RGB mode if it's in RGBA mode
-            if assigned_image and assigned_image.mode == "RGBA":
-                assigned_image = assigned_image.convert("RGB")
-
-            # Now you can save the image as JPEG
             if assigned_image:
-                image_stream = BytesIO()  # Reset the image stream
-                assigned_image.save(image_stream, format="JPEG")
-
-                # Get the image data in bytes
-                image_data = image_stream.getvalue()
-
-                # Assign the image data to the DataFrame
-                data_df.at[idx, "Images"] = image_data
+                images_column.append(image_to_jpeg_bytes(assigned_image))
+            else:
+                images_column.append(None)
 
+        # Assign the image data to the DataFrame
+        data_df["Images"] = pd.Series(images_column, index=data_df.index, dtype=object)
         all_data[sheet_name] = data_df
 
+    xls.close()
     return all_data
 
 
@@ -247,27 +317,99 @@ def combine_dataframes(dfs):
         return None
 
     combined_df = dfs[0]
-    for df in dfs[1:]:
-        combined_df = combined_df.concat(
-            df, on=["Vendor", "Unit #"], how="outer", suffixes=[None, None]
+    for i, df in enumerate(dfs[1:], start=1):
+        # Outer join on the units, suffixing the columns each frame repeats by its index
+        combined_df = combined_df.merge(
+            df, on=["Vendor", "Unit #"], how="outer", suffixes=(None, f"_{i}")
         )
 
     return combined_df
 
 
-# Function to generate MD5 hash for each row
-# We use this function to create a unique unit number for each row in a df
-def generate_md5_as_number(row):
-    # Check if the columns exist in the DataFrame
-    media_type = (
-        str(row.get("Media Type", "")) if not pd.isna(row.get("Media Type")) else ""
+# Columns hashed into the unique identifier of each row
+UNIQUE_ID_COLUMNS = ["Media Type", "Vendor", "Town ", "Unit #"]
+
+
+def generate_unique_ids(df):
+    """
+    Creates a unique unit number for each row in a df, by hashing its identifying
+    columns. Missing columns and values count as empty strings.
+    """
+    parts = []
+    for column in UNIQUE_ID_COLUMNS:
+        if column in df.columns:
+            values = df[column].astype(object)
+            parts.append(values.map(str).where(values.notna(), ""))
+        else:
+            parts.append(pd.Series("", index=df.index))
+    data_strings = parts[0].str.cat(parts[1:], sep="_")
+    return [hashlib.md5(data.encode()).hexdigest() for data in data_strings]
+
+
+# Sizes like "4.25'h x 3.16'w" or "(2) 4.25'h x 6.41'w"
+SIZE_PATTERN = re.compile(r"\(?\s*(\d+)?\s*\)?\s*(\d+(\.\d+)?)'h x (\d+(\.\d+)?)'w")
+
+
+def format_size(sizes):
+    """
+    Rewrites sizes in decimal feet as feet and inches, other values as strings.
+    Missing values are left as they are.
+    """
+    formatted = sizes.to_numpy(dtype=object, copy=True)
+    positions = np.flatnonzero(sizes.notna().to_numpy())
+    strings = pd.Series(formatted[positions]).astype(str)
+    formatted[positions] = strings
+
+    matches = strings.str.extractall(SIZE_PATTERN)
+    # If no matches, keep the original size strings
+    if matches.empty:
+        return pd.Series(formatted, index=sizes.index, name=sizes.name)
+
+    height = matches[1].astype(float).to_numpy()
+    width = matches[3].astype(float).to_numpy()
+
+    # Convert heights and widths to feet and inches, all at once
+    height_feet = height.astype(np.int64)
+    height_inches = np.round((height - height_feet) * 12).astype(np.int64)
+    width_feet = width.astype(np.int64)
+    width_inches = np.round((width - width_feet) * 12).astype(np.int64)
+
+    sizes_in_inches = pd.Series(
+        [
+            f"{hf}'{hi}\"h x {wf}'{wi}\"w"
+            for hf, hi, wf, wi in zip(
+                height_feet, height_inches, width_feet, width_inches
+            )
+        ],
+        index=matches.index,
     )
-    vendor = str(row.get("Vendor", "")) if not pd.isna(row.get("Vendor")) else ""
-    town = str(row.get("Town ", "")) if not pd.isna(row.get("Town ")) else ""
-    unit_number = str(row.get("Unit #", "")) if not pd.isna(row.get("Unit #")) else ""
+    joined = sizes_in_inches.groupby(level=0).agg(", ".join)
+    formatted[positions[joined.index]] = joined.to_numpy()
+    return pd.Series(formatted, index=sizes.index, name=sizes.name)
 
-    data_string = f"{media_type}_{vendor}_{town}_{unit_number}"
-    return hashlib.md5(data_string.encode()).hexdigest()
+
+def format_currency(values):
+    """
+    Formats amounts as "$1,234.50". Text that is not a plain number is left as it is.
+    """
+    is_text = values.map(type).eq(str)
+    strings = values[is_text].astype(str)
+    plain_number = (
+        strings.str.lstrip("-").str.replace(".", "", n=1, regex=False).str.isdigit()
+    )
+    is_text[is_text] = ~plain_number.to_numpy()
+    amounts = pd.to_numeric(values.where(~is_text), errors="coerce").astype(float)
+    return amounts.map("${:,.2f}".format).where(~is_text, values)
+
+
+def _map_distinct(values, transform):
+    """
+    Applies a transform of a Series of strings to values converted to strings,
+    running it once per distinct value instead of once per row.
+    """
+    codes, uniques = pd.factorize(values.astype(str))
+    transformed = transform(pd.Series(uniques, dtype=object)).to_numpy()
+    return pd.Series(transformed[codes], index=values.index, name=values.name)
 
 
 def clean_up(df: pd.DataFrame):
@@ -293,18 +435,20 @@ def clean_up(df: pd.DataFrame):
     illuminated_replacements = {"Yes": "Y", "No": "N"}
     # For the 'Facing' column if it exists
     if "Facing" in df.columns:
-        df["Facing"] = df["Facing"].astype(str).str.title().replace(facing_replacements)
+        df["Facing"] = _map_distinct(
+            df["Facing"], lambda facing: facing.str.title().replace(facing_replacements)
+        )
 
     # For the 'Illuminated?' column if it exists
     illuminated_column = next(
         (col for col in df.columns if "Illuminated?\n(Y or N)" in col), None
     )
     if illuminated_column:
-        df[illuminated_column] = (
-            df[illuminated_column]
-            .astype(str)
-            .str.capitalize()
-            .replace(illuminated_replacements)
+        df[illuminated_column] = _map_distinct(
+            df[illuminated_column],
+            lambda illuminated: illuminated.str.capitalize().replace(
+                illuminated_replacements
+            ),
         )
 
     # For the 'A18+ Weekly Impressions' column if it exists
@@ -312,92 +456,20 @@ def clean_up(df: pd.DataFrame):
         (col for col in df.columns if "A18+ Weekly Impressions" in col), None
     )
 
-    def safe_format(x):
-        try:
-            # Attempt to convert to float and format
-            return f"{float(x):,.0f}"
-        except (ValueError, TypeError):
-            # If conversion fails, return the original value
-            return x
-
     if impressions_column:
-        df[impressions_column] = pd.to_numeric(
-            df[impressions_column], errors="coerce"
-        ).fillna(df[impressions_column])
-        df[impressions_column] = df[impressions_column].apply(
-            lambda x: safe_format(x) if pd.notnull(x) else x
-        )
-
-    def format_size(size):
-        # Match patterns like "4.25'h x 3.16'w" or "(2) 4.25'h x 6.41'w"
-        matches = list(
-            re.finditer(r"\(?\s*(\d+)?\s*\)?\s*(\d+(\.\d+)?)'h x (\d+(\.\d+)?)'w", size)
+        impressions = pd.to_numeric(df[impressions_column], errors="coerce")
+        df[impressions_column] = impressions.map("{:,.0f}".format).where(
+            impressions.notna(), df[impressions_column]
         )
 
-        # If no matches, return the original size string
-        if not matches:
-            return size
-
-        formatted_sizes = []
-
-        for match in matches:
-            height = float(match.group(2))
-            width = float(match.group(4))
-
-            # Convert height to feet and inches
-            height_feet = int(height)
-            height_inches = round((height - height_feet) * 12)
-
-            # Convert width to feet and inches
-            width_feet = int(width)
-            width_inches = round((width - width_feet) * 12)
-
-            formatted_sizes.append(
-                f"{height_feet}'{height_inches}\"h x {width_feet}'{width_inches}\"w"
-            )
-
-        return ", ".join(formatted_sizes)
-
-    df["Size"] = df["Size"].apply(lambda x: format_size(str(x)) if pd.notnull(x) else x)
+    df["Size"] = format_size(df["Size"])
     # Format column with dollar sign
-    rate_column = next((col for col in df.columns if "4 Week Media Rate " in col), None)
-    if rate_column:
-        df[rate_column] = df[rate_column].apply(
-            lambda x: f"${float(x):,.2f}"
-            if pd.notnull(x) and isinstance(x, (int, float))
-            else (
-                x
-                if isinstance(x, str)
-                and not x.lstrip("-").replace(".", "", 1).isdigit()
-                else f"${float(x):,.2f}"
-            )
-        )
-    rate_column = next((col for col in df.columns if "Production Cost" in col), None)
-    if rate_column:
-        df[rate_column] = df[rate_column].apply(
-            lambda x: f"${float(x):,.2f}"
-            if pd.notnull(x) and isinstance(x, (int, float))
-            else (
-                x
-                if isinstance(x, str)
-                and not x.lstrip("-").replace(".", "", 1).isdigit()
-                else f"${float(x):,.2f}"
-            )
-        )
-    rate_column = next((col for col in df.columns if "Installation Cost " in col), None)
-    if rate_column:
-        df[rate_column] = df[rate_column].apply(
-            lambda x: f"${float(x):,.2f}"
-            if pd.notnull(x) and isinstance(x, (int, float))
-            else (
-                x
-                if isinstance(x, str)
-                and not x.lstrip("-").replace(".", "", 1).isdigit()
-                else f"${float(x):,.2f}"
-            )
-        )
+    for rate_name in ["4 Week Media Rate ", "Production Cost", "Installation Cost "]:
+        rate_column = next((col for col in df.columns if rate_name in col), None)
+        if rate_column:
+            df[rate_column] = format_currency(df[rate_column])
     # Generate a unique identifier for each
-    df["UniqueId"] = df.apply(generate_md5_as_number, axis=1)
+    df["UniqueId"] = generate_unique_ids(df)
 
     logger.info("Finished cleaning up the dataframe")
     return df
@@ -1,41 +1,47 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
-import http.client
-from urllib.parse import urlparse, urljoin
 import logging
 import os
+import shutil
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Shared by the redirect lookups so connections to Google are reused
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+_FILE_ID_RE = re.compile(r"/file/d/([a-zA-Z0-9_-]+)/view")
+_CD_FILENAME_RE = re.compile(r'filename="(.+)"')
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 def handle_protected_url(url):
     """Follow redirects and return the final URL."""
-    parsed_url = urlparse(url)
-    connection = (
-        http.client.HTTPSConnection(parsed_url.netloc)
-        if parsed_url.scheme == "https"
-        else http.client.HTTPConnection(parsed_url.netloc)
-    )
-
     try:
-        connection.request("GET", parsed_url.path + "?" + parsed_url.query)
-        response = connection.getresponse()
-
-        if response.status in [301, 302, 303, 307]:
-            location = response.getheader("Location")
-            new_url = urljoin(url, location)
-            return handle_protected_url(new_url)
-        elif response.status == 200:
-            return url
-        else:
-            logger.error(f"Error following redirect: HTTP status {response.status}")
-            raise Exception(f"Error following redirect: HTTP status {response.status}")
+        response = _session.head(url, allow_redirects=True, timeout=10)
+        if response.status_code != 200:
+            # Some servers do not answer HEAD, or only sign the URL for GET (e.g. S3
+            # presigned URLs answer HEAD with 403), so follow with a GET left unread
+            response = _session.get(url, allow_redirects=True, stream=True, timeout=10)
+            response.close()
+
+        if response.status_code == 200:
+            return response.url
+        logger.error(f"Error following redirect: HTTP status {response.status_code}")
+        raise Exception(f"Error following redirect: HTTP status {response.status_code}")
     except Exception as e:
         logger.error(f"Error processing URL {url}: {e}")
         raise Exception(f"Error processing URL {url}: {e}")
-    finally:
-        connection.close()
 
 
 def download_file_from_google_drive(url, destination_folder):
@@ -71,7 +77,7 @@ def download_file_from_google_drive(url, destination_folder):
 
 
 def get_file_id_from_url(url):
-    match = re.search(r"/file/d/([a-zA-Z0-9_-]+)/view", url)
+    match = _FILE_ID_RE.search(url)
     return match.group(1) if match else None
 
 
@@ -83,14 +89,12 @@ def get_confirm_token(response):
 
 
 def save_response_content(response, destination):
-    CHUNK_SIZE = 32768
-
-    logger.info("Trying to save to:", destination)  # Add this line for debugging
+    logger.info(f"Trying to save to: {destination}")  # Add this line for debugging
     try:
+        # Copy the raw stream in large blocks, undoing any gzip/deflate encoding
+        response.raw.decode_content = True
         with open(destination, "wb") as f:
-            for chunk in response.iter_content(CHUNK_SIZE):
-                if chunk:
-                    f.write(chunk)
+            shutil.copyfileobj(response.raw, f, DOWNLOAD_CHUNK_SIZE)
     except PermissionError as e:
         logger.error(f"Permission Error: {e}")
 
@@ -101,7 +105,7 @@ def get_filename_from_cd(cd):
     """
     if not cd:
         return None
-    fname = re.findall('filename="(.+)"', cd)
+    fname = _CD_FILENAME_RE.findall(cd)
     if len(fname) == 0:
         return None
     return fname[0]
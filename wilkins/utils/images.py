@@ -1,6 +1,4 @@
-from PIL import Image
-import numpy as np
-import cv2
+from PIL import Image, ImageOps
 import glob
 import os
 
@@ -16,18 +14,15 @@ def extract_images_and_filenames(directory):
     image_extensions = (".png", ".jpg", ".jpeg")
 
     # Search for image files in the directory
-    for file_path in glob.glob(os.path.join(directory, "*")):
+    for file_path in glob.iglob(os.path.join(directory, "*")):
         if file_path.lower().endswith(image_extensions):
             # Get filename from the file path
             file_name = os.path.basename(file_path)
             image_data["content"].append(file_name)
 
-            # Open the file in binary mode, read its content, and convert to PIL Image
-            with open(file_path, "rb") as file:
-                image_bytes = file.read()
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-                image_data["images"].append(pil_image)
+            # Decode the file with PIL, upright and in RGB like OpenCV's IMREAD_COLOR
+            with Image.open(file_path) as image:
+                pil_image = ImageOps.exif_transpose(image).convert("RGB")
+            image_data["images"].append(pil_image)
 
     return image_data
@@ -10,16 +10,19 @@ from urllib.parse import urlparse, parse_qs, urlunparse, urlencode
 
 logger = logging.getLogger(__name__)
 
+# Links in the body of an email, and in text that may quote them with single quotes
+_BODY_URL_RE = re.compile(r'(https?://[^\s<>"]+|www\.[^\s<>"]+)')
+_URL_RE = re.compile(r'https?://[^\s<>"\']+|www\.[^\s<>"\']+')
+
 
 def parse_msg_file(msg_file_path, attachment_dir):
-    url_pattern = r'(https?://[^\s<>"]+|www\.[^\s<>"]+)'
     # Open the .msg file
     with extract_msg.Message(msg_file_path) as msg:
         # Extract the email body text
         body = msg.body if msg.body else msg.htmlBody
 
         # Find all URLs in the body text
-        links = re.findall(url_pattern, body)
+        links = _BODY_URL_RE.findall(body)
 
         # List to hold attachment filenames
         attachments_list = []
@@ -83,26 +86,24 @@ def fetch_files_and_extract_links(directory):
     return all_links
 
 
-def extract_and_decode_urls(text):
-    url_pattern = r'https?://[^\s<>"\']+|www\.[^\s<>"\']+'
-    found_links = re.findall(url_pattern, text)
-
-    decoded_links = set()  # Using a set to automatically remove duplicates
-    for link in found_links:
-        # if 'linkprotect.cudasvc.com' in link:
-        #     # Skip protected links
-        #     continue
-
-        parsed_link = urllib.parse.urlparse(link)
-        query_params = urllib.parse.parse_qs(parsed_link.query)
-        target_url = query_params.get("url")
-
-        if target_url:
-            decoded_url = urllib.parse.unquote(target_url[0])
-            decoded_links.add(decoded_url)
-        else:
-            decoded_links.add(link)
+def _decode_url(link):
+    """Returns the target of a wrapped link (its url parameter), other links as they are"""
+    # Without a query string there is no url parameter, skip parsing the link
+    if "?" not in link:
+        return link
+
+    parsed_link = urllib.parse.urlparse(link)
+    query_params = urllib.parse.parse_qs(parsed_link.query)
+    target_url = query_params.get("url")
 
+    if target_url:
+        return urllib.parse.unquote(target_url[0])
+    return link
+
+
+def extract_and_decode_urls(text):
+    # Using a set to automatically remove duplicates
+    decoded_links = {_decode_url(match.group()) for match in _URL_RE.finditer(text)}
     return list(decoded_links)  # Convert back to list for consistency
 
 
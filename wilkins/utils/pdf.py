@@ -1,11 +1,97 @@
 import os
-import glob
+import asyncio
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import aiohttp
 import requests
 import fitz
 import logging
+from wilkins.utils.database import run_async
 
 logger = logging.getLogger(__name__)
 
+# PDFs downloaded at the same time by download_pdfs
+MAX_CONCURRENT_DOWNLOADS = 16
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Pages extracted per task, long documents are split over several workers
+PAGES_PER_TASK = 10
+
+
+def _image_bytes(pdf_document, img):
+    """
+    Returns the bytes of an image listed by page.get_images, as a JPEG or PNG file.
+    Plain JPEG streams are already such a file, so they are returned without decoding.
+    """
+    xref, filter_name = img[0], img[8]
+    # A Decode array changes the colors, MuPDF has to apply it
+    if (
+        filter_name == "DCTDecode"
+        and pdf_document.xref_get_key(xref, "Decode")[0] == "null"
+    ):
+        return pdf_document.xref_stream_raw(xref)
+    return pdf_document.extract_image(xref)["image"]
+
+
+def _extract_pdf_pages(pdf_file, start, stop):
+    """Extracts the text and the images of the pages [start, stop) of a PDF file"""
+    contents = []
+    images_per_page = []
+    # Each task opens its own document, MuPDF documents cannot be shared
+    pdf_document = fitz.open(pdf_file)
+    # Images repeated on several pages (logos, headers) share their xref
+    image_bytes_by_xref = {}
+    # Iterating through the pages in the pdf
+    for page_number in range(start, stop):
+        page = pdf_document[page_number]
+
+        # Extract Text
+        text = page.get_text()
+        contents.append(text)
+
+        # Extract Images
+        images = page.get_images(full=True)
+        image_bytes_list = []
+        for _, img in enumerate(images):
+            xref = img[0]
+            if xref not in image_bytes_by_xref:
+                image_bytes_by_xref[xref] = _image_bytes(pdf_document, img)
+            image_bytes_list.append(image_bytes_by_xref[xref])
+
+        images_per_page.append(image_bytes_list)
+
+    pdf_document.close()
+    return contents, images_per_page
+
+
+def _page_ranges(pdf_file):
+    """Splits the pages of a PDF file in ranges of at most PAGES_PER_TASK pages"""
+    with fitz.open(pdf_file) as pdf_document:
+        page_count = len(pdf_document)
+    return [
+        (pdf_file, start, min(start + PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PAGES_PER_TASK)
+    ]
+
+
+def _iter_pdfs(directory):
+    """
+    Yields the PDF files under a directory, in the order of
+    glob("**/*.pdf", recursive=True): the files of a directory before those of its
+    subdirectories, skipping hidden files and directories.
+    """
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                subdirectories.append(entry.path)
+            elif entry.name.endswith(".pdf"):
+                yield entry.path
+    for subdirectory in subdirectories:
+        yield from _iter_pdfs(subdirectory)
+
 
 def extract_pdf_content_and_images(attachment_dir):
     """Extracts text content and images from all PDF files in the attachment directory."""
@@ -13,65 +99,100 @@ def extract_pdf_content_and_images(attachment_dir):
         "content": [],
         "images": [],
     }
-    pdf_files = glob.glob(os.path.join(attachment_dir, "**", "*.pdf"), recursive=True)
-    for pdf_file in pdf_files:
-        pdf_document = fitz.open(pdf_file)
-        # Iterating through the pages in the pdf
-        for page_number in range(len(pdf_document)):
-            page = pdf_document[page_number]
-
-            # Extract Text
-            text = page.get_text()
-            pdf_data["content"].append(text)
-
-            # Extract Images
-            images = page.get_images(full=True)
-            image_bytes_list = []
-            for _, img in enumerate(images):
-                xref = img[0]
-                base_image = pdf_document.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_bytes_list.append(image_bytes)
-
-            pdf_data["images"].append(image_bytes_list)
-
-        pdf_document.close()
+    tasks = [
+        task
+        for pdf_file in _iter_pdfs(attachment_dir)
+        for task in _page_ranges(pdf_file)
+    ]
+
+    # Files and page ranges are independent, so extract them in parallel when there
+    # are several. Processes are used since MuPDF is not thread-safe, started from a
+    # fork server so they do not inherit the state of this process' threads
+    if len(tasks) > 1:
+        with ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context("forkserver"),
+        ) as executor:
+            results = list(executor.map(_extract_pdf_pages, *zip(*tasks)))
+    else:
+        results = [_extract_pdf_pages(*task) for task in tasks]
+
+    # Results come back in task order, so pages stay in document order
+    for contents, images_per_page in results:
+        pdf_data["content"].extend(contents)
+        pdf_data["images"].extend(images_per_page)
 
     return pdf_data
 
 
-def download_pdfs(url_list, download_folder):
+async def _download_pdf(session, semaphore, url, download_folder):
+    """Streams a PDF to the download folder, returns its path or None if it failed"""
+    # Correct filename determination
+    filename = url.split("/")[-1]
+    if not filename.lower().endswith(".pdf"):
+        filename += ".pdf"
+    file_path = os.path.join(download_folder, filename)
+
+    async with semaphore:
+        try:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                # Write to a temporary file first, so downloads of the same file name
+                # running at the same time cannot interleave their chunks. The file is
+                # written from worker threads, so the event loop of run_async, which
+                # also runs the API calls, is not blocked on disk
+                fd, temp_path = await asyncio.to_thread(
+                    tempfile.mkstemp, dir=download_folder, suffix=".part"
+                )
+                try:
+                    f = os.fdopen(fd, "wb")
+                    try:
+                        async for chunk in response.content.iter_chunked(
+                            DOWNLOAD_CHUNK_SIZE
+                        ):
+                            await asyncio.to_thread(f.write, chunk)
+                    finally:
+                        await asyncio.to_thread(f.close)
+                    await asyncio.to_thread(os.replace, temp_path, file_path)
+                except BaseException:
+                    os.remove(temp_path)
+                    raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info(f"Failed to download {url}: {str(e)}")
+            return None
+
+    logger.info(f"Downloaded {url}: {file_path}")
+    return file_path
+
+
+async def _download_pdfs(url_list, download_folder, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+    ) as session:
+        return await asyncio.gather(
+            *(
+                _download_pdf(session, semaphore, url, download_folder)
+                for url in url_list
+            )
+        )
+
+
+def download_pdfs(url_list, download_folder, concurrency=MAX_CONCURRENT_DOWNLOADS):
     """
-    Download PDFs from a list of URLs.
+    Download PDFs from a list of URLs, up to `concurrency` of them at a time.
 
     :param url_list: List of URLs pointing to PDF files.
     :param download_folder: The folder where PDFs will be downloaded.
+    :param concurrency: Maximum number of downloads in flight.
     :return: List of paths to the downloaded files.
     """
     if not os.path.exists(download_folder):
         os.makedirs(download_folder)
 
-    downloaded_files = []
-
-    for i, url in enumerate(url_list, start=1):
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-
-            # Correct filename determination
-            filename = url.split("/")[-1]
-            if not filename.lower().endswith(".pdf"):
-                filename += ".pdf"
-
-            file_path = os.path.join(download_folder, filename)
-            with open(file_path, "wb") as f:
-                f.write(response.content)
-
-            downloaded_files.append(file_path)
-            logger.info(f"Downloaded {i}/{len(url_list)}: {file_path}")
-        except requests.exceptions.RequestException as e:
-            logger.info(f"Failed to download {url}: {str(e)}")
-
+    file_paths = run_async(_download_pdfs(url_list, download_folder, concurrency))
+    downloaded_files = [file_path for file_path in file_paths if file_path]
+    logger.info(f"Downloaded {len(downloaded_files)}/{len(url_list)} PDFs")
     return downloaded_files
 
 
@@ -98,27 +219,29 @@ def download_pdf_and_upload_to_azure(
     :param blob_name: Name of the blob in Azure Storage. If None, the filename from the URL will be used.
     """
     try:
-        # Download the PDF file
-        response = requests.get(url)
-        # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
-        response.raise_for_status()
-
-        # Extract filename if blob_name not provided
-        if blob_name is None:
-            blob_name = url.split("/")[-1]
-
-        # Ensure the file is a PDF
-        if not blob_name.lower().endswith(".pdf"):
-            logger.error(f"The file from the URL {url} is not a PDF.")
-            return
-
-        # Prepare file path for temporary storage
-        # Using /tmp as a temporary folder
-        temp_file_path = os.path.join("/tmp", blob_name)
-
-        # Save the PDF file temporarily
-        with open(temp_file_path, "wb") as file:
-            file.write(response.content)
+        # Download the PDF file, streaming it so it is never held in memory whole
+        with requests.get(url, stream=True) as response:
+            # Will raise an HTTPError if the HTTP request returned an unsuccessful
+            # status code
+            response.raise_for_status()
+
+            # Extract filename if blob_name not provided
+            if blob_name is None:
+                blob_name = url.split("/")[-1]
+
+            # Ensure the file is a PDF
+            if not blob_name.lower().endswith(".pdf"):
+                logger.error(f"The file from the URL {url} is not a PDF.")
+                return
+
+            # Prepare file path for temporary storage
+            # Using /tmp as a temporary folder
+            temp_file_path = os.path.join("/tmp", blob_name)
+
+            # Save the PDF file temporarily
+            with open(temp_file_path, "wb") as file:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
 
         # Upload the file to Azure Blob Storage
         azure_storage.upload_file(container_name, temp_file_path, blob_name)
@@ -1,12 +1,57 @@
 from pptx import Presentation
 from io import BytesIO
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import logging
 from docx.shared import Pt
 from pptx.dml.color import RGBColor
+from wilkins.utils.excel import JPEG_BYTES_KEY, image_to_jpeg_bytes
 
 logger = logging.getLogger(__name__)
 
+# Slide images downloaded from Azure at the same time
+MAX_IMAGE_DOWNLOADS = 16
+
+# Submission fields listed in the details placeholder, in order, and their labels
+SLIDE_DETAIL_LABELS = {
+    "media_type": "Media Type",
+    "facing": "Facing",
+    "size": "size",
+    "is_illuminated": "Illuminated",
+    "availability_start": "Availability Start",
+    "availability_end": "Availability End",
+    "spot_length_secs": "Spot Length",
+    "a18_weekly_impressions": "Weekly Impressions",
+    "four_week_media_cost": "4 week Media Cost",
+    "installation_cost": "Installation Cost",
+    "production_cost": "Production Cost",
+}
+
+
+@lru_cache(maxsize=8)
+def _read_template(template_path):
+    """Reads a template file once per worker, decks are then opened from memory"""
+    with open(template_path, "rb") as template_file:
+        return template_file.read()
+
+
+def _fetch_slide_image(azure_storage, container_name, image_id):
+    """
+    Downloads a slide image and encodes it as JPEG, returning the JPEG image, which
+    keeps its encoded bytes so the slide can embed them without encoding it again.
+    """
+    image = azure_storage.get_image_as_pil(container_name, image_id)
+    try:
+        jpeg_bytes = image_to_jpeg_bytes(image)
+    except Exception:
+        # Leave it to add_slide, which reports the images it cannot add
+        return image
+
+    slide_image = Image.open(BytesIO(jpeg_bytes))
+    slide_image.info[JPEG_BYTES_KEY] = jpeg_bytes
+    return slide_image
+
 
 class PowerPointCreator:
     def __init__(self, submissions, template_path):
@@ -38,48 +83,14 @@ class PowerPointCreator:
             text_frame.clear()  # Clear existing text
             newline_check = 0  # A check to add a new line after a few values just to make the slides look a little better
             if placeholder_idx == 25:  # Special handling for the 25th placeholder
-                for key in [
-                    "media_type",
-                    "facing",
-                    "size",
-                    "is_illuminated",
-                    "availability_start",
-                    "availability_end",
-                    "spot_length_secs",
-                    "a18_weekly_impressions",
-                    "four_week_media_cost",
-                    "installation_cost",
-                    "production_cost",
-                ]:
+                for key, label in SLIDE_DETAIL_LABELS.items():
                     value = str(row.get(key, "N/A"))
-                    if key == "is_illuminated":
-                        key = "Illuminated"
-                    elif key == "spot_length_secs":
-                        key = "Spot Length"
-                    elif key == "media_type":
-                        key = "Media Type"
-                    elif key == "facing":
-                        key = "Facing"
-                    elif key == "availability_start":
-                        key = "Availability Start"
-                    elif key == "availability_end":
-                        key = "Availability End"
-                    elif key == "a18_weekly_impressions":
-                        key = "Weekly Impressions"
-                    elif key == "four_week_media_cost":
-                        key = "4 week Media Cost"
-                    elif key == "installation_cost":
-                        key = "Installation Cost"
-                    elif key == "production_cost":
-                        key = "Production Cost"
-                    
-                    
 
                     p = (
                         text_frame.add_paragraph()
                     )  # Create a new paragraph for each detail
                     run = p.add_run()
-                    run.text = f"{key}: "  # Set the key
+                    run.text = f"{label}: "  # Set the key
                     run.font.bold = True  # Bold for keys
 
                     run = p.add_run()
@@ -142,12 +153,8 @@ class PowerPointCreator:
                 shape.placeholder_format.idx == 21 and image
             ):  # 21 is the placeholder index for images
                 try:
-                    if image.mode == "RGBA":
-                        image = image.convert("RGB")
-
-                    image_stream = BytesIO()
-                    image.save(image_stream, format="JPEG")
-                    image_stream.seek(0)
+                    # Prefetched images are already encoded, others are encoded here
+                    image_stream = BytesIO(image_to_jpeg_bytes(image))
 
                     # Clear the placeholder content
                     sp = shape._sp
@@ -175,14 +182,29 @@ class PowerPointCreator:
                     logging.error(f"Error processing image for Unit {unit}: {e}")
 
     def create_presentation(self, path, azure_storage, container_name="attachments"):
-        prs = Presentation(self.template_path)
-        for idx, row in self.submissions.iterrows():
-            image = row["image_id"]
-            if image is not None:
-                # Fetch the image from Azure and update the 'image' variable
-                image = azure_storage.get_image_as_pil(container_name, image)
-            
-            self.add_slide(prs, row, image)
+        prs = Presentation(BytesIO(_read_template(self.template_path)))
+        image_ids = dict.fromkeys(
+            image_id
+            for image_id in self.submissions["image_id"]
+            if image_id is not None
+        )
+
+        # Fetch and encode the images in the background, each one once, while the
+        # slides are built in order on this thread since python-pptx is not thread-safe
+        with ThreadPoolExecutor(max_workers=MAX_IMAGE_DOWNLOADS) as executor:
+            image_futures = {
+                image_id: executor.submit(
+                    _fetch_slide_image, azure_storage, container_name, image_id
+                )
+                for image_id in image_ids
+            }
+            for idx, row in self.submissions.iterrows():
+                image = row["image_id"]
+                if image is not None:
+                    # Wait for the image from Azure and update the 'image' variable
+                    image = image_futures[image].result()
+
+                self.add_slide(prs, row, image)
 
         prs.save(path)
         logging.info("PowerPoint created successfully!")
@@ -1,15 +1,40 @@
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 import cv2
 import numpy as np
 from PIL import Image
-import hashlib
 
 logger = logging.getLogger(__name__)
 
+# Sine or cosine of a line angle below which is_urban_scene counts the line as
+# vertical or horizontal
+LINE_ANGLE_TOLERANCE = 0.05
+# Longest side images are shrunk to before the contour and line heuristics
+HEURISTICS_MAX_SIDE = 800
 
-def is_billboard(image):
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+def _resize_for_heuristics(image, max_side=HEURISTICS_MAX_SIDE):
+    """
+    Shrinks an image so its longest side is at most `max_side`.
+    Returns the image and the scale it was shrunk by, 1.0 if it was small enough.
+    """
+    scale = max_side / max(image.shape[:2])
+    if scale >= 1:
+        return image, 1.0
+    resized = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return resized, scale
+
+
+def is_billboard(image, gray=None, scale=1.0):
+    """
+    `gray` may be a grayscale copy of the image shrunk by `scale`, the area
+    thresholds stay in pixels of the full resolution image.
+    """
+    # Convert the image to grayscale, unless the caller already did
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # Adaptive thresholding for more robust edge detection
     thresh = cv2.adaptiveThreshold(
@@ -22,9 +47,9 @@ def is_billboard(image):
 
     for contour in contours:
         # Filter based on contour area to ignore very small/large contours
-        area = cv2.contourArea(contour)
+        area = cv2.contourArea(contour) / scale**2
         if (
-            area < 500 or area > gray.shape[0] * gray.shape[1] * 0.5
+            area < 500 or area > gray.shape[0] * gray.shape[1] / scale**2 * 0.5
         ):  # Adjust thresholds as needed
             continue
 
@@ -56,43 +81,61 @@ def has_significant_texture(region, area):
     return laplacian_var > texture_threshold
 
 
-def is_urban_scene(image):
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def is_urban_scene(image, gray=None, edges=None, scale=1.0):
+    """
+    `gray` and `edges` may be computed on the image shrunk by `scale`, the line
+    threshold stays in pixels of the full resolution image.
+    """
+    # Convert the image to grayscale, unless the caller already did
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # Edge detection
-    edges = cv2.Canny(gray, 50, 150, apertureSize=3)
+    if edges is None:
+        edges = cv2.Canny(gray, 50, 150, apertureSize=3)
 
     # Hough Line Transform
-    lines = cv2.HoughLines(edges, 1, np.pi / 180, 200)
+    lines = cv2.HoughLines(edges, 1, np.pi / 180, max(1, round(200 * scale)))
 
     vertical_lines = 0
     horizontal_lines = 0
 
     if lines is not None:
-        for line in lines:
-            for rho, theta in line:
-                a = np.cos(theta)
-                b = np.sin(theta)
-                if b == 0:  # vertical line
-                    vertical_lines += 1
-                elif a == 0:  # horizontal line
-                    horizontal_lines += 1
+        # Classify all the lines at once by the angle of their normal. The angles
+        # are floats, so lines within about 3 degrees of vertical or horizontal count
+        thetas = lines[:, 0, 1]
+        vertical_lines = np.count_nonzero(np.abs(np.sin(thetas)) < LINE_ANGLE_TOLERANCE)
+        horizontal_lines = np.count_nonzero(
+            np.abs(np.cos(thetas)) < LINE_ANGLE_TOLERANCE
+        )
+
+    # Without structures it is not an urban scene, whatever the sky looks like
+    has_structures = vertical_lines > 5 or horizontal_lines > 5
+    if not has_structures:
+        return False
 
     # Sky Detection
     upper_part = edges[0 : int(gray.shape[0] * 0.3), :]
-    variance = np.var(upper_part)
+    # The edges are 0 or 255, so their variance follows from the share of edge
+    # pixels, counted without converting the whole part to floats. Edges are one
+    # pixel wide at any scale, so their share is scaled back to the full resolution
+    if upper_part.size:
+        edge_share = cv2.countNonZero(upper_part) / upper_part.size * scale
+        variance = 255**2 * edge_share * (1 - edge_share)
+    else:
+        variance = np.nan
 
     # Heuristic thresholds
     is_sky = variance < 300
-    has_structures = vertical_lines > 5 or horizontal_lines > 5
 
     return is_sky and has_structures
 
 
 def is_map(image):
     # Color variance check (maps might have limited color palette)
-    variance = np.var(image)
+    # Combined from the per-channel statistics, without a float copy of the image
+    means, stds = cv2.meanStdDev(image)
+    variance = np.mean(stds**2 + means**2) - np.mean(means) ** 2
     if variance < 1200:
         return True
 
@@ -101,77 +144,126 @@ def is_map(image):
 
 def score_image(image):
     """Scores the image based on different criteria."""
+    # The grayscale image and its edges are shared by the criteria
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(gray, 50, 150, apertureSize=3)
+    # The contour and line heuristics run on a smaller copy of large images
+    small_gray, scale = _resize_for_heuristics(gray)
+    small_edges = edges if scale == 1 else cv2.Canny(small_gray, 50, 150)
+
     score = 0
-    if is_urban_scene(image):
+    if is_urban_scene(image, small_gray, small_edges, scale):
         score += 1  # Weight for urban scene
-    if is_billboard(image):
+    if is_billboard(image, small_gray, scale):
         score += 1  # Weight for billboard
     if not is_map(image):
         score += 1  # Weight for map
-    if not is_google_map(image):
+    if not is_google_map(image, gray, edges):
         score += 1
     return score
 
 
 def score_image_bus(image):
     """Scores the image based on different criteria."""
+    # The grayscale image is shared by the criteria
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
     score = 0
-    if is_bus(image):
+    if is_bus(image, gray):
         score += 1  # Weight for billboard
-    if not is_google_map(image):
+    if not is_google_map(image, gray):
         score += 1
     return score
 
 
-def filter_media(pdf_images):
-    logger.info("Filtering Images")
-    dups_removed = remove_all_duplicates(pdf_images)
-    media_images = []
+def _decode_and_score(image_bytes, image_index, score_function):
+    """Decodes an image and scores it, returns (None, None) if it is too small"""
     image_dimension_threshold = 300
 
-    for image_list in dups_removed:
-        highest_score = -1
-        best_image = None
-
-        for image_index, image_bytes in enumerate(image_list):
-            if image_bytes is not None:
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-                # Get image dimensions
-                h, w = image.shape[:2]
-
-                # Check against threshold
-                if w < image_dimension_threshold or h < image_dimension_threshold:
-                    logger.info(f"Skipping image is too small {image_index}")
-                    continue
-
-                # Calculate the score for the image
-                score = score_image(image)
-                if score > highest_score:
-                    highest_score = score
-                    best_image = image
-
-        if best_image is not None:
-            image_rgb = cv2.cvtColor(best_image, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(image_rgb)
-            media_images.append(pil_image)
+    # Read the dimensions from the image header first, so thumbnails are skipped
+    # without being decoded. The check holds whichever way the image is rotated
+    try:
+        with Image.open(BytesIO(image_bytes)) as header:
+            w, h = header.size
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        # PIL cannot read this header, decode the image to check its dimensions
+        w = h = image_dimension_threshold
+
+    if w < image_dimension_threshold or h < image_dimension_threshold:
+        logger.info(f"Skipping image is too small {image_index}")
+        return None, None
+
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+    # Get image dimensions
+    h, w = image.shape[:2]
+
+    # Check against threshold
+    if w < image_dimension_threshold or h < image_dimension_threshold:
+        logger.info(f"Skipping image is too small {image_index}")
+        return None, None
+
+    # Calculate the score for the image
+    return score_function(image), image
+
+
+def _best_images(image_lists, score_function, min_score):
+    """
+    Returns the first highest scoring image of each list, as an RGB PIL image,
+    or None if no image of the list scores above `min_score`.
+    """
+    tasks = [
+        (list_index, image_index, image_bytes)
+        for list_index, image_list in enumerate(image_lists)
+        for image_index, image_bytes in enumerate(image_list)
+        if image_bytes is not None
+    ]
+
+    # OpenCV decodes and filters without holding the GIL, so the images of all the
+    # lists are scored in parallel
+    best_images = {}
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = executor.map(
+            lambda task: _decode_and_score(task[2], task[1], score_function), tasks
+        )
+        for (list_index, _, _), (score, image) in zip(tasks, results):
+            highest_score = best_images.get(list_index, (min_score, None))[0]
+            if image is not None and score > highest_score:
+                best_images[list_index] = (score, image)
+
+    media_images = []
+    for list_index in range(len(image_lists)):
+        if list_index in best_images:
+            image_rgb = cv2.cvtColor(best_images[list_index][1], cv2.COLOR_BGR2RGB)
+            media_images.append(Image.fromarray(image_rgb))
         else:
             media_images.append(None)
 
     return media_images
 
 
-def is_google_map(image):
-    # Convert to grayscale for pattern recognition
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def filter_media(pdf_images):
+    logger.info("Filtering Images")
+    dups_removed = remove_all_duplicates(pdf_images)
+    return _best_images(dups_removed, score_image, min_score=-1)
+
+
+def is_google_map(image, gray=None, edges=None):
+    # Convert to grayscale for pattern recognition, unless the caller already did
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # Check for grid-like patterns (roads, etc.)
-    edges = cv2.Canny(gray, 50, 150, apertureSize=3)
+    if edges is None:
+        edges = cv2.Canny(gray, 50, 150, apertureSize=3)
     lines = cv2.HoughLinesP(
         edges, 1, np.pi / 180, threshold=100, minLineLength=100, maxLineGap=10
     )
     grid_like_structures = len(lines) if lines is not None else 0
+    # Without a grid the colors cannot make it a map, so they are not analysed
+    if grid_like_structures <= 5:
+        return False
 
     # Color analysis for typical map colors
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
@@ -182,6 +274,8 @@ def is_google_map(image):
     upper_blue = np.array([130, 255, 255])
     blue_mask = cv2.inRange(hsv, lower_blue, upper_blue)
     blue_area = cv2.countNonZero(blue_mask)
+    if blue_area <= 500:
+        return False
 
     lower_green = np.array([50, 100, 100])
     upper_green = np.array([70, 255, 255])
@@ -189,7 +283,7 @@ def is_google_map(image):
     green_area = cv2.countNonZero(green_mask)
 
     # Simple heuristic-based decision rule
-    if grid_like_structures > 5 and blue_area > 500 and green_area > 500:
+    if green_area > 500:
         return True
     else:
         return False
@@ -202,43 +296,35 @@ def remove_all_duplicates(page_images):
     :param page_images: List of lists containing images for each page.
     :return: List of lists with all duplicates replaced by None.
     """
-    image_hash_counts = {}
-    unique_images = []
-
-    # First pass: Count occurrences of each image
-    for images in page_images:
-        for image_bytes in images:
-            if image_bytes is not None:
-                # Check if image_bytes is already a bytes object
-                if not isinstance(image_bytes, bytes):
-                    # If it's a list of integers, convert it to bytes
-                    if isinstance(image_bytes, list):
-                        image_bytes = bytes(image_bytes)
-                    else:
-                        continue
-                img_hash = hashlib.md5(image_bytes).hexdigest()
-                image_hash_counts[img_hash] = image_hash_counts.get(img_hash, 0) + 1
-
-    # Second pass: Replace duplicates with None
+    # First pass: Convert lists of integers to bytes, and find the images seen more
+    # than once. The bytes are the keys themselves, their hash is computed once and
+    # cached, so no digest of the content is needed
+    normalized_pages = []
+    seen_images = set()
+    duplicate_images = set()
     for images in page_images:
-        page_images_with_none = []
+        normalized_images = []
         for image_bytes in images:
-            if image_bytes is not None:
-                # Check if image_bytes is already a bytes object
-                if not isinstance(image_bytes, bytes):
-                    # If it's a list of integers, convert it to bytes
-                    if isinstance(image_bytes, list):
-                        image_bytes = bytes(image_bytes)
-                img_hash = hashlib.md5(image_bytes).hexdigest()
-                # Replace duplicate image with None
-                if image_hash_counts[img_hash] > 1:
-                    page_images_with_none.append(None)
+            if isinstance(image_bytes, list):
+                image_bytes = bytes(image_bytes)
+            if isinstance(image_bytes, bytes):
+                if image_bytes in seen_images:
+                    duplicate_images.add(image_bytes)
                 else:
-                    page_images_with_none.append(image_bytes)
-            else:
-                page_images_with_none.append(None)  # Maintain None if originally None
+                    seen_images.add(image_bytes)
+            normalized_images.append(image_bytes)
+        normalized_pages.append(normalized_images)
 
-        unique_images.append(page_images_with_none)
+    # Second pass: Replace duplicates with None, and keep None if originally None
+    single_images = seen_images - duplicate_images
+    unique_images = []
+    for images in normalized_pages:
+        unique_images.append(
+            [
+                image_bytes if image_bytes in single_images else None
+                for image_bytes in images
+            ]
+        )
 
     return unique_images
 
@@ -246,43 +332,14 @@ def remove_all_duplicates(page_images):
 def filter_media_bus(pdf_images):
     logger.info("Filtering Images")
     dups_removed = remove_all_duplicates(pdf_images)
-    media_images = []
-    image_dimension_threshold = 300
-
-    for image_list in dups_removed:
-        highest_score = 1
-        best_image = None
-
-        for image_index, image_bytes in enumerate(image_list):
-            if image_bytes is not None:
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    media_images = _best_images(dups_removed, score_image_bus, min_score=1)
+    return [image for image in media_images if image is not None]
 
-                # Get image dimensions
-                h, w = image.shape[:2]
 
-                # Check against threshold
-                if w < image_dimension_threshold or h < image_dimension_threshold:
-                    logger.info(f"Skipping image is too small {image_index}")
-                    continue
-
-                # Calculate the score for the image
-                score = score_image_bus(image)
-                if score > highest_score:
-                    highest_score = score
-                    best_image = image
-
-        if best_image is not None:
-            image_rgb = cv2.cvtColor(best_image, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(image_rgb)
-            media_images.append(pil_image)
-
-    return media_images
-
-
-def is_bus(image):
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def is_bus(image, gray=None):
+    # Convert the image to grayscale, unless the caller already did
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # Apply Gaussian blur
     blurred = cv2.GaussianBlur(gray, (5, 5), 0)